@@ -0,0 +1,105 @@
+"""
+CoAP request rate with a client context and event loop created per request, the way
+CoAPWrapper.send used to work, against the persistent context of CoAPRuntime.
+
+Both variants POST to an echo resource served from its own loop and thread on the
+loopback interface, so only the client side differs.
+
+    python benchmarks/coap_context.py [--requests 500] [--payload 32] [--port 5690]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiocoap
+import aiocoap.resource as resource
+from communication_wrappers.coap_wrapper import CoAPRuntime
+
+SERVER_ADDRESS = "::1"
+
+
+class EchoResource(resource.Resource):
+
+    @asyncio.coroutine
+    def render_post(self, request):
+        return aiocoap.Message(code=aiocoap.CHANGED, payload=request.payload)
+
+
+def start_server(port):
+    started = threading.Event()
+
+    def run_server():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        root = resource.Site()
+        root.add_resource(('echo',), EchoResource())
+        loop.run_until_complete(aiocoap.Context.create_server_context(root, bind=(SERVER_ADDRESS, port)))
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run_server)
+    thread.daemon = True
+    thread.start()
+    started.wait()
+
+
+@asyncio.coroutine
+def request_per_call(send_loop, uri, payload):
+    asyncio.set_event_loop(send_loop)
+    context = yield from aiocoap.Context.create_client_context()
+    request = aiocoap.Message(code=aiocoap.POST, payload=payload)
+    request.set_request_uri(uri)
+    response = yield from context.request(request).response
+    yield from context.shutdown()
+    return response.payload
+
+
+def send_per_call(uri, payload):
+    send_loop = asyncio.new_event_loop()
+    try:
+        return send_loop.run_until_complete(request_per_call(send_loop, uri, payload))
+    finally:
+        send_loop.close()
+
+
+@asyncio.coroutine
+def request_persistent(runtime, uri, payload):
+    request = aiocoap.Message(code=aiocoap.POST, payload=payload)
+    request.set_request_uri(uri)
+    response = yield from runtime.client_context.request(request).response
+    return response.payload
+
+
+def send_persistent(uri, payload):
+    runtime = CoAPRuntime.get_instance()
+    return runtime.run(request_persistent(runtime, uri, payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--payload", type=int, default=32)
+    parser.add_argument("--port", type=int, default=5690)
+    args = parser.parse_args()
+
+    start_server(args.port)
+    uri = "coap://[" + SERVER_ADDRESS + "]:" + str(args.port) + "/echo"
+    payload = bytes(i & 0xff for i in range(args.payload))
+
+    print("%-12s %10s %10s" % ("context", "req/s", "ms/req"))
+    for name, send in (("per request", send_per_call), ("persistent", send_persistent)):
+        assert send(uri, payload) == payload
+        start = time.monotonic()
+        for i in range(args.requests):
+            send(uri, payload)
+        elapsed = time.monotonic() - start
+        print("%-12s %10.0f %10.2f" % (name, args.requests / elapsed, elapsed / args.requests * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Encode and decode rate of RPC header fields through the per-platform codec table,
+against building a ControlDataType for every field as RPCNode used to. The attribute
+datatypes are compared with LegacyControlDataType, which packs with the format string
+on every call the way ControlDataType did before it kept a compiled Struct.
+
+    python benchmarks/codec_table.py [--number 300000]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wishful_module_gitar.lib_gitar import ControlDataType
+from wishful_module_gitar.lib_msp430 import RM090
+
+
+class LegacyControlDataType(ControlDataType):
+
+    def to_bytes(self, *val):
+        tmp_fmt = self.fmt
+        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
+            tmp_fmt = self.endianness + self.fmt
+        return struct.pack(tmp_fmt, *val)
+
+    def read_bytes(self, buf):
+        tmp_fmt = self.fmt
+        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
+            tmp_fmt = self.endianness + self.fmt
+        tpl = struct.unpack_from(tmp_fmt, buf)
+        if len(tpl) == 1:
+            tpl = tpl[0]
+        return tpl
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=300000)
+    args = parser.parse_args()
+
+    platform = RM090()
+    buf = b'\x34\x12\x00\x00'
+    uint16_fmt = platform.get_data_type_format_by_name('UINT16')
+    datatype = ControlDataType('<', 'I')
+    legacy_datatype = LegacyControlDataType('<', 'I')
+
+    cases = [
+        ("ControlDataType per call encode", lambda: ControlDataType(platform.endianness_fmt, uint16_fmt).to_bytes(0x1234)),
+        ("ControlDataType per call decode", lambda: ControlDataType(platform.endianness_fmt, uint16_fmt).read_bytes(buf)),
+        ("codec table encode", lambda: platform.get_codec('UINT16').pack(0x1234)),
+        ("codec table decode", lambda: platform.get_codec('UINT16').unpack_from(buf)[0]),
+        ("legacy attribute datatype encode", lambda: legacy_datatype.to_bytes(5)),
+        ("legacy attribute datatype decode", lambda: legacy_datatype.read_bytes(buf)),
+        ("attribute datatype encode", lambda: datatype.to_bytes(5)),
+        ("attribute datatype decode", lambda: datatype.read_bytes(buf)),
+    ]
+    for name, case in cases:
+        elapsed = min(timeit.repeat(case, number=args.number, repeat=3))
+        print("%-34s %12.0f ops/s" % (name, args.number / elapsed))
+
+
+if __name__ == "__main__":
+    main()
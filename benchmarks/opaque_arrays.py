@@ -0,0 +1,80 @@
+"""
+Encoding and decoding of opaque arrays with one struct call for all elements, also as a
+NumPy record array, against LegacyOpaqueControlDataType, which packs element by element
+the way OpaqueControlDataType did before.
+
+    python benchmarks/opaque_arrays.py [--entries 100] [--number 2000]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wishful_module_gitar.lib_gitar import ControlDataType, OpaqueControlDataType
+
+
+class LegacyOpaqueControlDataType(OpaqueControlDataType):
+
+    def to_bytes(self, *val):
+        tmp_fmt = self.fmt
+        tmp_subfmt = self.sub_fmt
+        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
+            tmp_fmt = self.endianness + self.fmt
+            tmp_subfmt = self.endianness + self.sub_fmt
+        b_array = struct.pack(tmp_fmt, *val[0:len(self.fmt)])
+        offset = len(self.fmt)
+        while offset < len(val):
+            b_array = b_array + struct.pack(tmp_subfmt, *val[offset:offset + len(self.sub_fmt)])
+            offset += len(self.sub_fmt)
+        return b_array
+
+    def read_bytes(self, buf):
+        tmp_fmt = self.fmt
+        tmp_subfmt = self.sub_fmt
+        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
+            tmp_fmt = self.endianness + self.fmt
+            tmp_subfmt = self.endianness + self.sub_fmt
+        tpl = struct.unpack(tmp_fmt, buf[0:struct.calcsize(self.fmt)])
+        offset = struct.calcsize(self.fmt)
+        while offset < len(buf):
+            tpl = tpl + struct.unpack(tmp_subfmt, buf[offset:offset + struct.calcsize(self.sub_fmt)])
+            offset += struct.calcsize(self.sub_fmt)
+        return tpl
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    legacy = LegacyOpaqueControlDataType("<", "B", "HbB")
+    datatype = OpaqueControlDataType("<", "B", "HbB")
+    array_datatype = OpaqueControlDataType("<", "B", "HbB", as_array=True)
+    values = (args.entries % 256,) + tuple(v for i in range(args.entries) for v in (i, -i % 100, i % 256))
+    buf = datatype.to_bytes(*values)
+    assert legacy.to_bytes(*values) == buf
+    assert legacy.read_bytes(buf) == datatype.read_bytes(buf) == values
+
+    print("format B/HbB, %d entries (%d bytes)" % (args.entries, len(buf)))
+    cases = [
+        ("legacy encode", lambda: legacy.to_bytes(*values)),
+        ("single struct encode", lambda: datatype.to_bytes(*values)),
+        ("legacy decode", lambda: legacy.read_bytes(buf)),
+        ("single struct decode", lambda: datatype.read_bytes(buf)),
+    ]
+    try:
+        import numpy
+        cases.append(("record array decode", lambda: array_datatype.read_bytes(buf)))
+    except ImportError:
+        print("numpy is not installed, skipping the record array decode")
+    for name, case in cases:
+        elapsed = min(timeit.repeat(case, number=args.number, repeat=3))
+        print("%-22s %8.1f us" % (name, elapsed / args.number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
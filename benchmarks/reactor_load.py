@@ -0,0 +1,112 @@
+"""
+CPU time, peak RSS and thread count of the agent side while reading the console
+output of 1, 16 and 64 nodes, with one blocking reader thread per pipe (the way the
+wrappers used to read) against the shared IOReactor.
+
+Every node is a child process printing serialdump/tunslip like lines at a fixed rate,
+each measurement runs in a fresh interpreter so the peak RSS is not shared.
+
+    python benchmarks/reactor_load.py [--nodes 1,16,64] [--duration 10] [--rate 50]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WARMUP = 3.0
+
+NODE_SCRIPT = """
+import sys, time
+period = 1.0 / %f
+line = b"FFFF 0123456789abcdef 0123456789abcdef 0123456789abcdef\\n"
+while True:
+    sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
+    time.sleep(period)
+"""
+
+
+def start_nodes(num_nodes, rate):
+    return [subprocess.Popen([sys.executable, "-c", NODE_SCRIPT % rate], stdout=subprocess.PIPE) for i in range(num_nodes)]
+
+
+def run_threads(nodes, counter):
+    def listen(process):
+        while True:
+            line = process.stdout.readline().strip()
+            if not line:
+                break
+            counter[0] += 1
+
+    for process in nodes:
+        thread = threading.Thread(target=listen, args=(process,))
+        thread.daemon = True
+        thread.start()
+
+
+def run_reactor(nodes, counter):
+    from communication_wrappers.lib_reactor import IOReactor, LineReader
+
+    def on_line(line):
+        counter[0] += 1
+
+    reactor = IOReactor.get_instance()
+    for process in nodes:
+        reactor.register(process.stdout, LineReader(on_line).feed)
+
+
+def measure(mode, num_nodes, duration, rate):
+    nodes = start_nodes(num_nodes, rate)
+    counter = [0]
+    try:
+        if mode == "threads":
+            run_threads(nodes, counter)
+        else:
+            run_reactor(nodes, counter)
+        # let the node interpreters start up before measuring
+        time.sleep(WARMUP)
+        lines_start = counter[0]
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        time.sleep(duration)
+        cpu = time.process_time() - cpu_start
+        wall = time.monotonic() - wall_start
+        lines = counter[0] - lines_start
+        threads = threading.active_count()
+    finally:
+        for process in nodes:
+            process.kill()
+            process.wait()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%s %d %f %f %d %d %d" % (mode, num_nodes, cpu, wall, rss_kb, threads, lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", default="1,16,64")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=50.0, help="lines per second per node")
+    parser.add_argument("--measure", nargs=2, metavar=("MODE", "NODES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        measure(args.measure[0], int(args.measure[1]), args.duration, args.rate)
+        return
+
+    print("%-8s %6s %10s %10s %8s %10s" % ("mode", "nodes", "cpu %", "rss MiB", "threads", "lines/s"))
+    for num_nodes in [int(n) for n in args.nodes.split(",")]:
+        for mode in ("threads", "reactor"):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--duration", str(args.duration),
+                                              "--rate", str(args.rate), "--measure", mode, str(num_nodes)], universal_newlines=True)
+            mode, num_nodes, cpu, wall, rss_kb, threads, lines = output.split()
+            print("%-8s %6s %10.2f %10.1f %8s %10.0f" % (mode, num_nodes, float(cpu) / float(wall) * 100,
+                                                          int(rss_kb) / 1024, threads, int(lines) / float(wall)))
+
+
+if __name__ == "__main__":
+    main()
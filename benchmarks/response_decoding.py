@@ -0,0 +1,89 @@
+"""
+Decoding of RPC responses. The field loop compares slicing the rest of the buffer for
+every field, as RPCNode used to, with unpack_from at an offset into a memoryview. The
+batched responses are decoded by RPCNode.create_attr_key_value_from_bytearray.
+
+    python benchmarks/response_decoding.py [--number 200]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wishful_module_gitar.lib_gitar import ProtocolConnector, ControlDataType, OpaqueControlDataType, Measurement
+from wishful_module_gitar.lib_msp430 import RM090
+from wishful_module_gitar.rpc_node import RPCNode
+
+
+class NoTransport():
+    """
+    The responses are decoded straight from memory, nothing is sent
+    """
+    mtu = 2048
+
+    def add_event_callback(self, cb):
+        pass
+
+
+def field_loop(number):
+    codec = struct.Struct("<I")
+    for num_fields in (100, 250, 1000):
+        buf = bytearray(struct.pack("<%dI" % num_fields, *range(num_fields)))
+
+        def sliced():
+            offset = 0
+            values = []
+            for i in range(num_fields):
+                values.append(codec.unpack_from(buf[offset:])[0])
+                offset += codec.size
+            return values
+
+        def offsets():
+            view = memoryview(buf)
+            offset = 0
+            values = []
+            for i in range(num_fields):
+                values.append(codec.unpack_from(view, offset)[0])
+                offset += codec.size
+            return values
+
+        assert sliced() == offsets()
+        sliced_us = min(timeit.repeat(sliced, number=number, repeat=3)) / number * 1e6
+        offsets_us = min(timeit.repeat(offsets, number=number, repeat=3)) / number * 1e6
+        print("%4d fields (%4d bytes): sliced %7.1f us, offsets %7.1f us" % (num_fields, len(buf), sliced_us, offsets_us))
+
+
+def batched_responses(number):
+    node = RPCNode("lowpan0", RM090(), NoTransport())
+    connector = ProtocolConnector(1, "radio")
+    node.add_connector(connector)
+    neighbours = Measurement(400, "neighbours", OpaqueControlDataType("<", "B", "HbB"))
+    node.add_measurement(connector, neighbours)
+    for i in range(100):
+        node.add_measurement(connector, Measurement(500 + i, "m%d" % i, ControlDataType("<", "I")))
+
+    for num_entries in (100, 250):
+        values = (num_entries,) + tuple(v for i in range(num_entries) for v in (i, -i % 100, i % 256))
+        buf = bytearray(struct.pack("<H", neighbours.uid) + neighbours.datatype.to_bytes(*values))
+        assert node.create_attr_key_value_from_bytearray("measurement", 1, buf)["neighbours"] == values
+        elapsed = min(timeit.repeat(lambda: node.create_attr_key_value_from_bytearray("measurement", 1, buf), number=number, repeat=3))
+        print("opaque table, %d entries (%d bytes): %.1f us" % (num_entries, len(buf), elapsed / number * 1e6))
+
+    buf = bytearray(b"".join(struct.pack("<HI", 500 + i, i) for i in range(100)))
+    elapsed = min(timeit.repeat(lambda: node.create_attr_key_value_from_bytearray("measurement", 100, buf), number=number, repeat=3))
+    print("100 UINT32 measurements (%d bytes): %.1f us" % (len(buf), elapsed / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    field_loop(args.number)
+    batched_responses(args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Command round trip latency of CustomNode waiting for the response on a condition
+against the former 100 ms polling loop.
+
+The node talks to a loopback stand-in for the serial transport that answers every
+command after --delay seconds from another thread, as the reactor would. The polling
+variant is CustomNode with the waiting loop it used before.
+
+    python benchmarks/response_latency.py [--commands 50] [--delay 0.005]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wishful_module_gitar.custom_node import CustomNode
+
+
+class LoopbackMote():
+    """
+    Answers a single parameter write with a zero error code after a fixed delay
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.rx_callback = None
+
+    def set_rx_callback(self, rx_callback):
+        self.rx_callback = rx_callback
+
+    def send(self, message):
+        # header and parameter header are echoed, the value is replaced by the error code
+        response = bytearray(message[:-1]) + b'\x00'
+        threading.Timer(self.delay, self.rx_callback, (0, response)).start()
+
+    def print_byte_array(self, b):
+        pass
+
+
+class PollingCustomNode(CustomNode):
+    """
+    CustomNode waiting for the response the way it did before, polling every 100 ms for up to 1 s
+    """
+
+    def _CustomNode__await_command_response(self):
+        wait_time = 0
+        while self._CustomNode__awaiting_command_response and wait_time < 1.0:
+            time.sleep(0.1)
+            wait_time += 0.1
+        if self._CustomNode__awaiting_command_response:
+            self._CustomNode__awaiting_command_response = False
+            self.log.info("command response timeout")
+            return False
+        return True
+
+
+def measure(node_class, num_commands, delay):
+    node = node_class("/dev/null", "", "", "lowpan0", LoopbackMote(delay))
+    node.register_parameters("radio", [{"unique_name": "channel", "unique_id": "1", "type_name": "UINT8_T"}])
+    latencies = []
+    for i in range(num_commands):
+        start = time.monotonic()
+        result = node.write_parameters("radio", {"channel": 26})
+        latencies.append(time.monotonic() - start)
+        assert result == {"channel": 0}, result
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.005, help="response time of the mote in seconds")
+    args = parser.parse_args()
+
+    print("%-10s %10s %10s %10s %10s" % ("waiting", "mean ms", "median ms", "max ms", "cmds/s"))
+    for name, node_class in (("polling", PollingCustomNode), ("condition", CustomNode)):
+        latencies = measure(node_class, args.commands, args.delay)
+        print("%-10s %10.1f %10.1f %10.1f %10.1f" % (name, statistics.mean(latencies) * 1e3, statistics.median(latencies) * 1e3,
+                                                     max(latencies) * 1e3, len(latencies) / sum(latencies)))
+
+
+if __name__ == "__main__":
+    main()
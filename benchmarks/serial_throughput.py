@@ -0,0 +1,164 @@
+"""
+Frame throughput of the SLIP transport against the serialdump helper pipe, in both
+directions, over a pseudo terminal standing in for the mote's serial port.
+
+The SerialdumpWrapper runs the real serialdump-linux helper, which is started from
+the relative path used in a deployment (agent_modules/contiki two levels up), so a
+temporary directory with that layout is used as working directory. A pty has no line
+rate, the measured numbers are the host side limit. The limit imposed by the line
+rate follows from the wire bytes per frame and is printed for --baudrate.
+
+    python benchmarks/serial_throughput.py [--frames 200] [--payload 64] [--baudrate 115200]
+"""
+import argparse
+import base64
+import os
+import pty
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import crc16
+from communication_wrappers.slip_wrapper import SLIPSerialWrapper, SLIPDecoder, slip_encode
+from communication_wrappers.serialdump_wrapper import SerialdumpWrapper, SerialdumpFrameDecoder, SerialHeader
+
+# the serialdump helper waits a second after opening the port and then flushes it
+HELPER_STARTUP = 1.5
+
+
+class MoteSide():
+    """
+    Master side of the pty, counts the frames the wrapper sends with the given decoder
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.num_frames = 0
+        self.num_bytes = 0
+        self.done = threading.Event()
+        self.expected = None
+        self.decoder = None
+        thread = threading.Thread(target=self.__read)
+        thread.daemon = True
+        thread.start()
+
+    def expect(self, decoder, expected):
+        self.num_frames = 0
+        self.num_bytes = 0
+        self.expected = expected
+        self.done.clear()
+        self.decoder = decoder
+
+    def count(self):
+        self.num_frames += 1
+        if self.expected is not None and self.num_frames >= self.expected:
+            self.done.set()
+
+    def __read(self):
+        while True:
+            try:
+                chunk = os.read(self.fd, 4096)
+            except OSError:
+                return
+            if self.decoder is not None:
+                self.num_bytes += len(chunk)
+                self.decoder(chunk)
+
+
+def slip_frame(seq, payload):
+    frame = struct.pack('<B B', SLIPSerialWrapper.FRAME_DATA, seq) + payload
+    return slip_encode(frame + struct.pack('<H', crc16.crc16xmodem(frame)))
+
+
+def serialdump_frame(payload):
+    encoded = base64.b64encode(payload)
+    header_len = len(bytes(SerialHeader()))
+    return bytes([len(payload) + header_len, len(encoded) + header_len]) + b'F' * (header_len - 2) + encoded + b'\n'
+
+
+def run(name, wrapper, mote, mote_decoder, frames_from_mote, num_frames, payload, baudrate):
+    received = [0]
+    rx_done = threading.Event()
+
+    def rx_callback(error, frame):
+        if error == 0:
+            received[0] += 1
+            if received[0] >= num_frames:
+                rx_done.set()
+
+    wrapper.set_rx_callback(rx_callback)
+    time.sleep(HELPER_STARTUP)
+
+    # agent to mote
+    mote.expect(mote_decoder, num_frames)
+    start = time.monotonic()
+    for i in range(num_frames):
+        wrapper.send(payload)
+    mote.done.wait(600)
+    tx_time = time.monotonic() - start
+    wire_bytes = mote.num_bytes / max(mote.num_frames, 1)
+
+    # mote to agent
+    start = time.monotonic()
+    for frame in frames_from_mote:
+        os.write(mote.fd, frame)
+    rx_done.wait(600)
+    rx_time = time.monotonic() - start
+
+    line_rate = baudrate / 10.0 * len(payload) / wire_bytes
+    print("%-11s %9.0f %9.0f %11.0f %11.0f %7.1f %12.0f" % (name, mote.num_frames / tx_time, received[0] / rx_time,
+                                                           mote.num_frames * len(payload) / tx_time, received[0] * len(payload) / rx_time,
+                                                           wire_bytes, line_rate))
+
+
+def open_pty():
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return master, os.ttyname(slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--payload", type=int, default=64, help="payload bytes per frame, at most %d" % SerialdumpWrapper.MTU)
+    parser.add_argument("--baudrate", type=int, default=115200, help="line rate for the wire limited column")
+    args = parser.parse_args()
+    payload = bytes(range(args.payload % 256)) * (args.payload // 256) + bytes(range(args.payload % 256))
+    payload = payload[:args.payload]
+
+    print("%-11s %9s %9s %11s %11s %7s %12s" % ("transport", "tx fr/s", "rx fr/s", "tx B/s", "rx B/s", "wire B", "line B/s"))
+
+    master, slave_dev = open_pty()
+    mote = MoteSide(master)
+    wrapper = SLIPSerialWrapper(slave_dev, "lowpan0")
+
+    def slip_decode(chunk):
+        for frame in slip_decoder.feed(chunk):
+            if frame is not None and frame[0] == SLIPSerialWrapper.FRAME_DATA:
+                mote.count()
+
+    slip_decoder = SLIPDecoder()
+    run("SLIP", wrapper, mote, slip_decode, [slip_frame(i & 0xff, payload) for i in range(args.frames)], args.frames, payload, args.baudrate)
+
+    master, slave_dev = open_pty()
+    mote = MoteSide(master)
+    run_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(run_dir, "agent_modules"))
+    os.symlink(REPO_DIR, os.path.join(run_dir, "agent_modules", "contiki"))
+    os.makedirs(os.path.join(run_dir, "a", "b"))
+    os.chdir(os.path.join(run_dir, "a", "b"))
+    wrapper = SerialdumpWrapper(slave_dev, "lowpan0")
+    serialdump_decoder = SerialdumpFrameDecoder(lambda error, frame: mote.count() if error == 0 else None, lambda line: None)
+    run("serialdump", wrapper, mote, serialdump_decoder.feed, [serialdump_frame(payload) for i in range(args.frames)], args.frames, payload, args.baudrate)
+    wrapper.serialdump_process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Decoding rate of SerialdumpFrameDecoder on framed serialdump traffic with interleaved
+console lines. The stream is fed in the chunks a reader polling every --interval seconds
+gets at each line rate, the CPU time per second of line traffic shows how much of a core
+the decoder needs to keep up. LegacySerialdumpFrameDecoder copies every decoded frame
+into a bytearray the way SerialdumpFrameDecoder did before.
+
+    python benchmarks/serialdump_decoder.py [--frames 5000] [--payload 64] [--text-every 10] [--interval 0.002]
+"""
+import argparse
+import base64
+import binascii
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communication_wrappers.serialdump_wrapper import SerialdumpFrameDecoder, SerialHeader, SerialdumpWrapper
+
+BAUDRATES = (115200, 921600)
+
+
+class LegacySerialdumpFrameDecoder(SerialdumpFrameDecoder):
+
+    def _SerialdumpFrameDecoder__decode_frame(self, decoded_len, encoded):
+        try:
+            frame = bytearray(binascii.a2b_base64(encoded))
+        except (binascii.Error, ValueError):
+            self.num_errors += 1
+            self.frame_cb(1, None)
+            return
+        if len(frame) + SerialdumpFrameDecoder.HEADER_LEN != decoded_len:
+            self.num_errors += 1
+            self.frame_cb(1, None)
+            return
+        self.num_frames += 1
+        self.frame_cb(0, frame)
+
+
+def serialdump_frame(payload):
+    encoded = base64.b64encode(payload)
+    header_len = len(bytes(SerialHeader()))
+    return bytes([len(payload) + header_len, len(encoded) + header_len]) + b'F' * (header_len - 2) + encoded + b'\n'
+
+
+def create_stream(num_frames, payload_len, text_every):
+    stream = bytearray()
+    for i in range(num_frames):
+        stream.extend(serialdump_frame(bytes((i + j) & 0xff for j in range(payload_len))))
+        if text_every > 0 and i % text_every == 0:
+            stream.extend(b"printf output of frame %d\n" % i)
+    return bytes(stream)
+
+
+def decode(decoder_class, stream, chunk_len):
+    frames = [0]
+    decoder = decoder_class(lambda error, frame: frames.__setitem__(0, frames[0] + (error == 0)), lambda line: None)
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for offset in range(0, len(stream), chunk_len):
+        decoder.feed(stream[offset:offset + chunk_len])
+    return frames[0], time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--payload", type=int, default=64, help="payload bytes per frame, at most %d" % SerialdumpWrapper.MTU)
+    parser.add_argument("--text-every", type=int, default=10, help="a console line after every n frames, 0 for none")
+    parser.add_argument("--interval", type=float, default=0.002, help="seconds between reads of the serial port")
+    args = parser.parse_args()
+
+    stream = create_stream(args.frames, args.payload, args.text_every)
+    print("%d frames of %d bytes, %d stream bytes" % (args.frames, args.payload, len(stream)))
+    print("%-7s %-8s %6s %10s %10s %12s" % ("baud", "decoder", "chunk", "frames/s", "MB/s", "CPU at line"))
+    for baudrate in BAUDRATES:
+        # 10 bit times per byte on the line
+        line_rate = baudrate / 10.0
+        chunk_len = max(1, int(line_rate * args.interval))
+        for name, decoder_class in (("legacy", LegacySerialdumpFrameDecoder), ("current", SerialdumpFrameDecoder)):
+            results = [decode(decoder_class, stream, chunk_len) for i in range(3)]
+            num_frames, elapsed, cpu = min(results, key=lambda result: result[2])
+            assert num_frames == args.frames
+            print("%-7d %-8s %6d %10.0f %10.2f %11.2f%%" % (baudrate, name, chunk_len, num_frames / elapsed, len(stream) / elapsed / 1e6,
+                                                          100.0 * cpu * line_rate / len(stream)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Encoding and decoding of a nested struct/array format through the compiled
+StructuredControlDataType, and the cost of compiling a format specifier against
+looking it up in the per-platform cache.
+
+    python benchmarks/struct_layouts.py [--records 100] [--number 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wishful_module_gitar.lib_gitar import StructuredControlDataType
+from wishful_module_gitar.lib_msp430 import RM090
+from wishful_module_gitar.lib_sensor import parse_format_specifier
+
+FORMAT_SPECIFIER = "UINT8;[-1;{UINT16;INT8;UINT8}]"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    platform = RM090()
+    datatype = platform.compile_format_specifier(FORMAT_SPECIFIER)
+    values = (args.records, [(i, -(i % 100), i % 256) for i in range(args.records)])
+    buf = datatype.to_bytes(*values)
+    assert datatype.read_bytes(buf) == values
+
+    print("format %s, %d records (%d bytes)" % (FORMAT_SPECIFIER, args.records, len(buf)))
+    cases = [
+        ("encode", lambda: datatype.to_bytes(*values)),
+        ("decode", lambda: datatype.read_bytes(buf)),
+        ("parse and compile", lambda: StructuredControlDataType(platform.endianness_fmt, parse_format_specifier(FORMAT_SPECIFIER, platform), FORMAT_SPECIFIER)),
+        ("cached lookup", lambda: platform.compile_format_specifier(FORMAT_SPECIFIER)),
+    ]
+    for name, case in cases:
+        elapsed = min(timeit.repeat(case, number=args.number, repeat=3))
+        print("%-18s %8.1f us" % (name, elapsed / args.number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
 from .lib_communication_wrapper import *
+from .lib_firewall import *
+from .lib_event_queue import *
+from .lib_console import *
+from .lib_reactor import *
 from .serialdump_wrapper import *
+from .slip_wrapper import *
 from .coap_wrapper import *
@@ -119,6 +119,16 @@ int main(int argc, char **argv)
 	 	  } else if (strcmp(&argv[index][2], "230400") == 0) {
 			speed = B230400;
 			speedname = "230400";
+#ifdef B460800
+          } else if(strcmp(&argv[index][2], "460800") == 0) {
+            speed = B460800;
+            speedname = "460800";
+#endif
+#ifdef B921600
+          } else if(strcmp(&argv[index][2], "921600") == 0) {
+            speed = B921600;
+            speedname = "921600";
+#endif
           } else {
             fprintf(stderr, "unsupported speed: %s\n", &argv[index][2]);
             return usage(1);
@@ -941,6 +941,14 @@ exit(1);
 		b_rate = B115200;
 	  } else if (baudrate == 230400) {
 		b_rate = B230400;
+#ifdef B460800
+	  } else if (baudrate == 460800) {
+		b_rate = B460800;
+#endif
+#ifdef B921600
+	  } else if (baudrate == 921600) {
+		b_rate = B921600;
+#endif
 	  } else {
 		fprintf(stderr, "unsupported speed: %d\n", baudrate);
 	  }
@@ -1,141 +1,456 @@
 import logging
 # from coapthon.client.helperclient import HelperClient
-from communication_wrappers.lib_communication_wrapper import CommunicationWrapper
+from communication_wrappers.lib_communication_wrapper import CommunicationWrapper, BaudrateRegistry
+from communication_wrappers.lib_firewall import TunslipFirewall
+from communication_wrappers.lib_console import ConsoleBuffer
+from communication_wrappers.lib_reactor import IOReactor, LineReader
 import subprocess
 import threading
+import errno
+import random
+import time
+
+import ipaddress
+import concurrent.futures
 
 import asyncio
 import aiocoap
+import aiocoap.error
 import aiocoap.resource as resource
-import gevent
+from aiocoap.optiontypes import BlockOption
+from aiocoap.numbers import TransportTuning
+
+# aiocoap reports an exhausted CON exchange as RequestTimedOut (older releases) or ConRetransmitsExceeded
+COAP_TIMEOUT_ERRORS = tuple(getattr(aiocoap.error, name) for name in ("RequestTimedOut", "ConRetransmitsExceeded") if hasattr(aiocoap.error, name))
+
+
+class RTTEstimator():
+    """
+    Per node retransmission timeout estimator following CoCoA (draft-ietf-core-cocoa).
+    A strong estimator is fed with RTTs of requests answered without retransmission,
+    a weak estimator with RTTs (measured from the first transmission) of requests
+    that needed retransmissions. Both are combined into one overall RTO.
+
+    The RTO is the initial ACK timeout of the node's CON exchanges, the retransmissions
+    themselves (same message ID and token) and their binary backoff are done by aiocoap.
+    """
+
+    ALPHA = 0.125
+    BETA = 0.25
+    K_STRONG = 4
+    K_WEAK = 1
+    INITIAL_RTO = 2.0
+    MIN_RTO = 0.1
+    MAX_RTO = 60.0
+
+    def __init__(self, initial_rto=INITIAL_RTO):
+        self.rto = initial_rto
+        self.rto_updated = time.monotonic()
+        self.__estimators = {"strong": [None, None], "weak": [None, None]}
+        self.num_strong_samples = 0
+        self.num_weak_samples = 0
+        self.num_timeouts = 0
+        self.last_rtt = None
+
+    def __update_estimator(self, name, k, rtt):
+        est = self.__estimators[name]
+        if est[0] is None:
+            est[0] = rtt
+            est[1] = rtt / 2
+        else:
+            est[1] = (1 - RTTEstimator.BETA) * est[1] + RTTEstimator.BETA * abs(est[0] - rtt)
+            est[0] = (1 - RTTEstimator.ALPHA) * est[0] + RTTEstimator.ALPHA * rtt
+        return est[0] + k * est[1]
+
+    def __set_rto(self, rto):
+        self.rto = min(max(rto, RTTEstimator.MIN_RTO), RTTEstimator.MAX_RTO)
+        self.rto_updated = time.monotonic()
+
+    def add_strong_sample(self, rtt):
+        self.last_rtt = rtt
+        self.num_strong_samples += 1
+        rto_strong = self.__update_estimator("strong", RTTEstimator.K_STRONG, rtt)
+        self.__set_rto(0.5 * rto_strong + 0.5 * self.rto)
+
+    def add_weak_sample(self, rtt):
+        self.last_rtt = rtt
+        self.num_weak_samples += 1
+        rto_weak = self.__update_estimator("weak", RTTEstimator.K_WEAK, rtt)
+        self.__set_rto(0.25 * rto_weak + 0.75 * self.rto)
+
+    def initial_rto(self):
+        # age RTOs that have not been updated for a while towards the default
+        idle = time.monotonic() - self.rto_updated
+        if self.rto < 1.0 and idle > 16 * self.rto:
+            self.__set_rto(2 * self.rto)
+        elif self.rto > 3.0 and idle > 4 * self.rto:
+            self.__set_rto(1.0 + 0.5 * self.rto)
+        return self.rto
+
+    def get_stats(self):
+        return {
+            "rto": self.rto,
+            "last_rtt": self.last_rtt,
+            "srtt_strong": self.__estimators["strong"][0],
+            "rttvar_strong": self.__estimators["strong"][1],
+            "srtt_weak": self.__estimators["weak"][0],
+            "rttvar_weak": self.__estimators["weak"][1],
+            "num_strong_samples": self.num_strong_samples,
+            "num_weak_samples": self.num_weak_samples,
+            "num_timeouts": self.num_timeouts,
+        }
+
+
+class CoAPRuntime():
+    """
+    Shared asyncio runtime for all CoAP wrappers: a single event loop running in
+    a dedicated thread with one long-lived aiocoap client context and one event
+    server that receives the events of all nodes.
+    """
+    instance = None
+    __instance_lock = threading.Lock()
+
+    EVENT_SERVER_ADDRESS = "::"
+    EVENT_SERVER_PORT = 5683
+    CONTROL_PREFIX_LENGTH = 64
+
+    def __init__(self):
+        self.log = logging.getLogger('CoAPRuntime')
+        self.server_context = None
+        self.__event_wrappers = {}
+        self.__server_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.__loop_thread = threading.Thread(target=self.__run_loop)
+        self.__loop_thread.daemon = True
+        self.__loop_thread.start()
+        self.client_context = self.run(aiocoap.Context.create_client_context())
+
+    @classmethod
+    def get_instance(cls):
+        with cls.__instance_lock:
+            if cls.instance is None:
+                cls.instance = CoAPRuntime()
+        return cls.instance
+
+    def __run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the runtime loop, returns a concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Schedule a coroutine on the runtime loop and wait for its result
+        """
+        return self.submit(coro).result(timeout)
+
+    @asyncio.coroutine
+    def coap_event_server(self):
+        root = resource.Site()
+        root.add_resource(('.well-known', 'core'), resource.WKCResource(root.get_resources_as_linkheader))
+        root.add_resource(('wishful_events',), EventResource(self))
+        context = yield from aiocoap.Context.create_server_context(root, bind=(CoAPRuntime.EVENT_SERVER_ADDRESS, CoAPRuntime.EVENT_SERVER_PORT))
+        return context
+
+    def register_event_wrapper(self, comm_wrapper):
+        """
+        Route events sent from the control prefix of comm_wrapper to it.
+        The shared event server is started on the first registration.
+        """
+        network = ipaddress.ip_network(comm_wrapper.control_prefix + "/" + str(CoAPRuntime.CONTROL_PREFIX_LENGTH), strict=False)
+        self.__event_wrappers[network] = comm_wrapper
+        with self.__server_lock:
+            if self.server_context is None:
+                self.server_context = self.run(self.coap_event_server())
+
+    def get_event_wrapper(self, source_address):
+        # strip the zone index of link-local addresses
+        address = ipaddress.ip_address(source_address.split("%")[0])
+        network = ipaddress.ip_network((address, CoAPRuntime.CONTROL_PREFIX_LENGTH), strict=False)
+        return self.__event_wrappers.get(network)
+
+    def shutdown(self):
+        if self.server_context is not None:
+            self.run(self.server_context.shutdown())
+        self.run(self.client_context.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
 
 class CoAPWrapper(CommunicationWrapper):
 
-    def __init__(self, node_id, serial_dev, serial_baudrate, serial_delay="0"):
+    # REST_MAX_CHUNK_SIZE of the Contiki CoAP engine, larger payloads need a blockwise transfer
+    MTU = 64
+    # seconds to wait for the node to accept an observer
+    OBSERVE_TIMEOUT = 10.0
+
+    def __init__(self, node_id, serial_dev, serial_baudrate=None, serial_delay="0", max_in_flight=4, max_retransmit=4, firewall=None, console_size=1000, console_log_rate=10, mtu=MTU):
         self.node_id = node_id
+        self.mtu = mtu
+        if serial_baudrate is None:
+            serial_baudrate = BaudrateRegistry.get(serial_dev)
+        self.serial_baudrate = int(serial_baudrate)
+        serial_baudrate = str(serial_baudrate)
+        self.max_in_flight = max_in_flight
+        self.max_retransmit = max_retransmit
+        self.rtt_estimator = RTTEstimator()
         self.control_prefix = "fd00:c:" + str(node_id) + "::"
         # self.control_prefix = "fd00:c::"
         control_tunslip_interface_id = "1"
         prefix_length = "/64"
         tunslip_ip_addr = self.control_prefix + control_tunslip_interface_id + prefix_length
         self.log = logging.getLogger('CoAPWrapper.' + str(self.node_id))
+        self.console = ConsoleBuffer('CoAPWrapper.' + str(self.node_id), console_size, console_log_rate)
 
         if "cooja" in serial_dev:
             cmd = 'sudo ../../agent_modules/contiki/communication_wrappers/bin/tunslip6-cooja -C -D' + serial_delay + ' -B ' + serial_baudrate + ' -s ' + serial_dev + ' ' + tunslip_ip_addr
             self.log.info(cmd)
-            self.slip_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/tunslip6-cooja', '-D' + serial_delay, '-B', serial_baudrate, '-C', '-s' + serial_dev, tunslip_ip_addr], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            self.slip_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/tunslip6-cooja', '-D' + serial_delay, '-B', serial_baudrate, '-C', '-s' + serial_dev, tunslip_ip_addr], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         else:
             cmd = 'sudo ../../agent_modules/contiki/communication_wrappers/bin/tunslip6 -C -B ' + serial_baudrate + ' -s ' + serial_dev + ' ' + tunslip_ip_addr
             self.log.info(cmd)
-            self.slip_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/tunslip6', '-D' + serial_delay, '-B', serial_baudrate, '-C', '-s' + serial_dev, tunslip_ip_addr], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            self.slip_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/tunslip6', '-D' + serial_delay, '-B', serial_baudrate, '-C', '-s' + serial_dev, tunslip_ip_addr], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             # self.slip_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/tunslip6', '-v5', '-D' + serial_delay, '-B', serial_baudrate, '-C', '-s' + serial_dev, tunslip_ip_addr], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
 
-        if int(subprocess.check_output("sudo ip6tables -C INPUT -d " + tunslip_ip_addr + " -j ACCEPT 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo ip6tables -I INPUT 1 -d " + tunslip_ip_addr + " -j ACCEPT", shell=True, universal_newlines=True).strip()
-
-        if int(subprocess.check_output("sudo ip6tables -C OUTPUT -s " + tunslip_ip_addr + " -j ACCEPT 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo ip6tables -I OUTPUT 1 -s " + tunslip_ip_addr + " -j ACCEPT", shell=True, universal_newlines=True).strip()
+        # the firewall rules of all nodes are applied at once by the owner of a shared firewall
+        if firewall is not None:
+            firewall.add_node(tunslip_ip_addr)
+        else:
+            firewall = TunslipFirewall()
+            firewall.add_node(tunslip_ip_addr)
+            firewall.apply()
 
-        if int(subprocess.check_output("sudo ip6tables -C OUTPUT -o tun+ -j DROP 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo ip6tables -A OUTPUT -o tun+ -j DROP", shell=True, universal_newlines=True).strip()
+        # the console output of all tunslip processes is read by the shared I/O reactor thread
+        IOReactor.get_instance().register(self.slip_process.stdout, LineReader(self.console.append).feed)
+        self.event_cb = None
+        self.runtime = CoAPRuntime.get_instance()
+        self.__in_flight = 0
+        self.__in_flight_sem = None
+        self.num_non_sent = 0
+        self.num_non_responses = 0
+        self.runtime.register_event_wrapper(self)
 
-        if int(subprocess.check_output("sudo ip6tables -C FORWARD -o tun+ -j DROP 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo ip6tables -A FORWARD -o tun+ -j DROP", shell=True, universal_newlines=True).strip()
+    @asyncio.coroutine
+    def coap_send(self, payload):
+        # the semaphore is created lazily so it is bound to the runtime loop
+        if self.__in_flight_sem is None:
+            self.__in_flight_sem = asyncio.Semaphore(self.max_in_flight)
+        yield from self.__in_flight_sem.acquire()
+        self.__in_flight += 1
+        try:
+            response = yield from self.__request(self.__create_request("wishful_funcs", payload))
+        finally:
+            self.__in_flight -= 1
+            self.__in_flight_sem.release()
+        # self.log.info("Result: %s\n%s\n%r" % (response.code, response, response.payload))
+        return response.payload
 
-        if int(subprocess.check_output("sudo ip6tables -C FORWARD -i tun+ -j DROP 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo ip6tables -A FORWARD -i tun+ -j DROP", shell=True, universal_newlines=True).strip()
+    def __create_request(self, resource_path, payload):
+        request = aiocoap.Message(code=aiocoap.POST, payload=payload)
+        request.set_request_uri('coap://[' + self.control_prefix + '2]/' + resource_path)
+        return request
 
-        if int(subprocess.check_output("sudo iptables -C OUTPUT -o tun+ -j DROP 2> /dev/null; echo $?", shell=True, universal_newlines=True).strip()) > 0:
-            subprocess.check_output("sudo iptables -A OUTPUT -o tun+ -j DROP", shell=True, universal_newlines=True).strip()
-        
-        self.__thread_stop = threading.Event()
-        self.__rx_thread = threading.Thread(target=self.__serial_listen, args=(self.__thread_stop,))
-        self.__rx_thread.daemon = True
-        self.__rx_thread.start()
-        self.__response = None
-        self.event_cb = None
-        self.event_loop = asyncio.new_event_loop()
-        __event_thread = threading.Thread(target=self.__event_server, args=(self, "fd00:c:" + str(node_id) + "::1", 5683))
-        __event_thread.daemon = True
-        __event_thread.start()
+    @asyncio.coroutine
+    def __request(self, request, handle_blockwise=True):
+        """
+        Send a CON request whose ACK timeout is the RTO of the node's RTT estimator, aiocoap
+        retransmits the same message (message ID and token) up to max_retransmit times.
+        Only an answer received before the first retransmission could have been sent is a strong sample.
+        """
+        loop = self.runtime.loop
+        ack_timeout = self.rtt_estimator.initial_rto()
+        tuning = TransportTuning()
+        tuning.ACK_TIMEOUT = ack_timeout
+        tuning.MAX_RETRANSMIT = self.max_retransmit
+        request.transport_tuning = tuning
+        first_tx = loop.time()
+        try:
+            response = yield from self.runtime.client_context.request(request, handle_blockwise=handle_blockwise).response
+        except COAP_TIMEOUT_ERRORS:
+            self.rtt_estimator.num_timeouts += 1
+            self.log.info("request timed out after %d transmissions", self.max_retransmit + 1)
+            raise TimeoutError(errno.ETIMEDOUT, "CoAP request to node " + str(self.node_id) + " timed out")
+        rtt = loop.time() - first_tx
+        if rtt < ack_timeout:
+            self.rtt_estimator.add_strong_sample(rtt)
+        else:
+            self.rtt_estimator.add_weak_sample(rtt)
+        return response
 
     @asyncio.coroutine
-    def coap_send(self, send_loop, payload):
-        asyncio.set_event_loop(send_loop)
-        context = yield from aiocoap.Context.create_client_context()
-        request = aiocoap.Message(code=aiocoap.POST, payload=payload)
-        request.set_request_uri('coap://[' + self.control_prefix + '2]/wishful_funcs')
-        response = yield from context.request(request).response
-        # self.log.info("Result: %s\n%s\n%r" % (response.code, response, response.payload))
-        self.__response = response.payload
-        yield from context.shutdown()
+    def coap_send_blockwise(self, resource_path, payload, size_exp):
+        if self.__in_flight_sem is None:
+            self.__in_flight_sem = asyncio.Semaphore(self.max_in_flight)
+        yield from self.__in_flight_sem.acquire()
+        self.__in_flight += 1
+        try:
+            block_num = 0
+            while True:
+                block_size = 2 ** (size_exp + 4)
+                offset = block_num * block_size
+                block1 = BlockOption.BlockwiseTuple(block_num, offset + block_size < len(payload), size_exp)
+                request = self.__create_request(resource_path, payload[offset:offset + block_size])
+                request.opt.block1 = block1
+                response = yield from self.__request(request, handle_blockwise=False)
+                resp_block1 = response.opt.block1
+                if response.code == aiocoap.REQUEST_ENTITY_TOO_LARGE and resp_block1 is not None and resp_block1.size_exponent < size_exp:
+                    # the node does not accept the block size, restart with the size it asked for
+                    size_exp = resp_block1.size_exponent
+                    block_num = 0
+                    continue
+                if not response.code.is_successful():
+                    self.log.info("blockwise transfer to %s failed at offset %d: %s", resource_path, offset, response.code)
+                    return False
+                if not block1.more:
+                    return True
+                if resp_block1 is not None and resp_block1.size_exponent < size_exp:
+                    # the node negotiated a smaller block size (RFC 7959 2.5), it did store the whole block,
+                    # so continue after it in blocks of the new size
+                    block_num = (offset + block_size) // 2 ** (resp_block1.size_exponent + 4)
+                    size_exp = resp_block1.size_exponent
+                else:
+                    block_num += 1
+        finally:
+            self.__in_flight -= 1
+            self.__in_flight_sem.release()
+
+    def send_blockwise(self, resource_path, payload, size_exp=None):
+        """
+        POST a large payload to a resource of the node using a Block1 blockwise transfer.
+        The transfer starts with blocks of 2 ** (size_exp + 4) bytes, by default the largest
+        block size that fits in the mtu, and continues with the smaller block size if the node
+        negotiates one.
+        Returns True if the node accepted all blocks.
+        """
+        if size_exp is None:
+            # block sizes range from 16 (size_exp 0) to 1024 bytes (size_exp 6)
+            size_exp = max(0, min(6, self.mtu.bit_length() - 5))
+        return self.runtime.run(self.coap_send_blockwise(resource_path, bytes(payload), size_exp))
+
+    def send_async(self, payload):
+        """
+        Send a request without waiting for the response.
+        Returns a concurrent.futures.Future that resolves to the response payload.
+        At most max_in_flight requests are outstanding on the link, others are queued.
+        """
+        return self.runtime.submit(self.coap_send(payload))
 
     def send(self, payload):
-        if True:
-            send_loop = asyncio.new_event_loop()
-            # __event_thread = threading.Thread(target=self.async_send, args=(payload,))
-            # __event_thread.start()
-            # __event_thread.join()
-            # # send_task = asyncio.async(self.coap_send(payload))
-            # yield from asyncio.wait_for(send_task)
-            send_loop.run_until_complete(self.coap_send(send_loop, payload))
-            # asyncio.get_event_loop().run_until_complete(self.coap_send(payload))
-            # while self.__response is None:
-            #     gevent.sleep(0.1)
-            return self.__response
-        # else:
-        #     client = HelperClient(server=(self.control_prefix + "2", 5683))
-        #     response = client.post("wishful_funcs", payload)
-        #     client.stop()
-        #     return response.payload
-
-    def __serial_listen(self, stop_event):
-        while not stop_event.is_set():
-            o = self.slip_process.stdout.readline().strip()
-            if o:
-                self.log.info("%s", o)
+        return self.send_async(payload).result()
+
+    def __send_non(self, payload):
+        request = self.__create_request("wishful_funcs", payload)
+        request.mtype = aiocoap.NON
+        self.num_non_sent += 1
+        self.runtime.client_context.request(request).response.add_done_callback(self.__non_response_done)
+
+    def __non_response_done(self, response_future):
+        # nobody waits for the response of a non-confirmable request, only account for it
+        if response_future.cancelled():
+            return
+        if response_future.exception() is not None:
+            self.log.debug("non-confirmable request failed: %s", response_future.exception())
+        else:
+            self.num_non_responses += 1
+
+    def send_nowait(self, payload):
+        """
+        Send a non-confirmable (NON) request and return immediately.
+        The request is neither retransmitted nor acknowledged, a later read or event confirms its effect.
+        """
+        self.runtime.loop.call_soon_threadsafe(self.__send_non, payload)
 
     @asyncio.coroutine
-    def coap_event_server(self, comm_wrapper, ip6_address, coap_port):
-        root = resource.Site()
-        root.add_resource(('.well-known', 'core'), resource.WKCResource(root.get_resources_as_linkheader))
-        root.add_resource(('wishful_events',), EventResource(comm_wrapper))
-        yield from aiocoap.Context.create_server_context(root, bind=(ip6_address, coap_port))
-
-    def __event_server(self, comm_wrapper, ip6_address, coap_port):
-        asyncio.set_event_loop(self.event_loop)
-        gevent.sleep(5)
-        send_task = asyncio.async(self.coap_event_server(comm_wrapper, ip6_address, coap_port), loop=self.event_loop)
-        print(send_task)
+    def coap_observe(self, resource_path, query, notification_cb):
+        request = aiocoap.Message(code=aiocoap.GET)
+        request.set_request_uri('coap://[' + self.control_prefix + '2]/' + resource_path + "?" + "&".join(query))
+        request.opt.observe = 0
+        observed_request = self.runtime.client_context.request(request)
         try:
-            while self.event_loop.is_running():
-                gevent.sleep(1)
-            else:
-                self.event_loop.run_forever()
-        finally:
-            print("ended")
-            self.event_loop.close()
+            response = yield from observed_request.response
+        except asyncio.CancelledError:
+            observed_request.observation.cancel()
+            raise
+        if not response.code.is_successful():
+            self.log.info("observing %s failed: %s", resource_path, response.code)
+            observed_request.observation.cancel()
+            return None
+        observed_request.observation.register_callback(lambda notification: self.__deliver(notification_cb, notification.payload))
+        observed_request.observation.register_errback(lambda exc: self.log.info("observation of %s ended: %s", resource_path, exc))
+        # the initial response already carries a notification
+        self.__deliver(notification_cb, response.payload)
+        return observed_request.observation
+
+    def __deliver(self, cb, payload):
+        # same contract as the event callback, the loop never waits for a full queue
+        if cb(payload, False) is None:
+            self.runtime.loop.run_in_executor(None, cb, payload)
+
+    def observe(self, resource_path, query, notification_cb, timeout=OBSERVE_TIMEOUT):
+        """
+        Register as observer of a resource on the node. notification_cb(payload, block=True) is called
+        with the payload of every notification, with the same contract as the event callback.
+        Returns the observation or None if the node refused to register the observer or did not
+        answer within timeout seconds.
+        """
+        future = self.runtime.submit(self.coap_observe(resource_path, query, notification_cb))
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.log.info("no answer to observing %s within %.1f s", resource_path, timeout)
+            return None
+
+    def cancel_observation(self, observation):
+        self.runtime.loop.call_soon_threadsafe(observation.cancel)
+
+    def get_baudrate(self):
+        return self.serial_baudrate
+
+    def num_in_flight(self):
+        return self.__in_flight
+
+    def get_rtt_stats(self):
+        return self.rtt_estimator.get_stats()
 
     def add_event_callback(self, cb):
+        """
+        cb(payload, block=True) is called for every event of the node from the runtime loop with block
+        set to False, it returns None when it would have to block, after which it is called again
+        from an executor thread.
+        """
         self.event_cb = cb
 
 
 class EventResource(resource.Resource):
     """
-    Example resource which supports GET and PUT methods. It sends large
-    responses, which trigger blockwise transfer.
+    Resource receiving the events of all nodes, events are routed to the
+    CoAPWrapper of the node based on the source address.
     """
 
-    def __init__(self, comm_wrapper):
+    def __init__(self, runtime):
         super(EventResource, self).__init__()
-        self.comm_wrapper = comm_wrapper
+        self.runtime = runtime
+        self.log = logging.getLogger('CoAPEventResource')
 
     @asyncio.coroutine
     def render_post(self, request):
         content = request.payload
-        # print("Event from {}, payload {}".format(request.remote.sockaddr[0], content))
-        if self.comm_wrapper.event_cb is not None:
-            self.comm_wrapper.event_cb(content)
+        source_address = request.remote.sockaddr[0]
+        comm_wrapper = self.runtime.get_event_wrapper(source_address)
+        # print("Event from {}, payload {}".format(source_address, content))
+        if comm_wrapper is None:
+            self.log.info("Event from unknown node %s, dropping", source_address)
+        elif comm_wrapper.event_cb is not None:
+            # the loop is shared by all nodes and must never block, a full queue under the BLOCK policy is
+            # waited for in an executor thread, delaying only the acknowledgement to this node
+            if comm_wrapper.event_cb(content, False) is None:
+                yield from self.runtime.loop.run_in_executor(None, comm_wrapper.event_cb, content)
         response = aiocoap.Message(code=aiocoap.EMPTY, payload="")
         return response
@@ -1,4 +1,6 @@
 import abc
+import logging
+import threading
 
 class CommunicationWrapper():
     __metaclass__ = abc.ABCMeta
@@ -10,3 +12,34 @@ class CommunicationWrapper():
     @abc.abstractmethod
     def set_rx_callback(rx_callback):
         return
+
+
+DEFAULT_BAUDRATE = 115200
+# rates supported by the serialdump and tunslip helpers, highest first
+HIGH_BAUDRATES = (921600, 460800, 230400)
+
+
+class BaudrateRegistry():
+    """
+    Remembers the serial link speed per device, either configured or negotiated
+    by a transport, so later wrappers for the same device start at that rate.
+    """
+    __baudrates = {}
+    __lock = threading.Lock()
+    log = logging.getLogger('BaudrateRegistry')
+
+    @classmethod
+    def get(cls, serial_dev, default=DEFAULT_BAUDRATE):
+        with cls.__lock:
+            return cls.__baudrates.get(serial_dev, default)
+
+    @classmethod
+    def set(cls, serial_dev, baudrate):
+        with cls.__lock:
+            cls.__baudrates[serial_dev] = int(baudrate)
+        cls.log.info("Serial link %s running at %d baud", serial_dev, int(baudrate))
+
+    @classmethod
+    def get_all(cls):
+        with cls.__lock:
+            return dict(cls.__baudrates)
@@ -0,0 +1,75 @@
+import collections
+import logging
+import re
+import threading
+import time
+
+
+ConsoleLine = collections.namedtuple("ConsoleLine", ["timestamp", "source", "line"])
+
+
+class ConsoleBuffer():
+    """
+    Keeps the most recent console lines of a node in memory. Only a rate limited
+    number of lines per second is forwarded to the log (log_rate, 0 disables it).
+    """
+
+    def __init__(self, source, maxlen=1000, log_rate=10, log_level=logging.INFO):
+        self.log = logging.getLogger('Console.' + source)
+        self.source = source
+        self.log_rate = log_rate
+        self.log_level = log_level
+        self.num_lines = 0
+        self.num_suppressed = 0
+        self.__lines = collections.deque(maxlen=maxlen)
+        self.__lock = threading.Lock()
+        self.__window_start = time.monotonic()
+        self.__window_count = 0
+        self.__window_suppressed = 0
+
+    def append(self, line):
+        entry = ConsoleLine(time.time(), self.source, line)
+        with self.__lock:
+            self.__lines.append(entry)
+            self.num_lines += 1
+        if self.log_rate > 0 and self.log.isEnabledFor(self.log_level):
+            self.__tap(line)
+
+    def __tap(self, line):
+        now = time.monotonic()
+        if now - self.__window_start >= 1.0:
+            if self.__window_suppressed > 0:
+                self.log.log(self.log_level, "%d console lines not logged", self.__window_suppressed)
+            self.__window_start = now
+            self.__window_count = 0
+            self.__window_suppressed = 0
+        if self.__window_count < self.log_rate:
+            self.__window_count += 1
+            self.log.log(self.log_level, "%s", line)
+        else:
+            self.__window_suppressed += 1
+            self.num_suppressed += 1
+
+    def get_recent(self, num_lines=None):
+        """
+        Returns the last num_lines console lines (all buffered lines by default), oldest first
+        """
+        with self.__lock:
+            lines = list(self.__lines)
+        if num_lines is not None:
+            lines = lines[-num_lines:]
+        return lines
+
+    def search(self, pattern, num_lines=None):
+        """
+        Returns the buffered console lines matching the regular expression pattern, oldest first
+        """
+        regex = re.compile(pattern)
+        matches = [entry for entry in self.get_recent() if regex.search(entry.line)]
+        if num_lines is not None:
+            matches = matches[-num_lines:]
+        return matches
+
+    def clear(self):
+        with self.__lock:
+            self.__lines.clear()
@@ -0,0 +1,108 @@
+import collections
+import logging
+import threading
+import traceback
+import sys
+from enum import Enum
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+    BLOCK = 2
+
+
+class EventQueue():
+    """
+    Bounded queue decoupling event reception from event dispatching.
+    Events are handed to the handler by a pool of worker threads, so a slow
+    subscriber does not stall the reception of later events.
+    """
+
+    def __init__(self, handler, maxsize=256, overflow_policy=OverflowPolicy.DROP_OLDEST, num_workers=1, key_func=None, name=""):
+        self.log = logging.getLogger('EventQueue.' + name)
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.key_func = key_func
+        self.__queue = collections.deque()
+        self.__cond = threading.Condition()
+        self.__stats = {"received": 0, "dispatched": 0, "failed": 0, "dropped": 0, "discarded": 0}
+        self.__stats_by_key = {}
+        self.__workers = []
+        for i in range(0, num_workers):
+            worker = threading.Thread(target=self.__worker)
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    def __count(self, key, counter):
+        self.__stats[counter] += 1
+        if key is not None:
+            if key not in self.__stats_by_key:
+                self.__stats_by_key[key] = {"received": 0, "dispatched": 0, "failed": 0, "dropped": 0, "discarded": 0}
+            self.__stats_by_key[key][counter] += 1
+
+    def discard(self, event):
+        """
+        Count an event the caller decided not to queue, e.g. one nobody subscribed to
+        """
+        key = None
+        if self.key_func is not None:
+            key = self.key_func(event)
+        with self.__cond:
+            self.__count(key, "discarded")
+
+    def put(self, event, block=True):
+        """
+        Queue an event, returns False if the event was dropped.
+        When the queue is full under the BLOCK policy and block is False, None is returned
+        instead of waiting and the event is not queued, the caller has to retry it.
+        """
+        key = None
+        if self.key_func is not None:
+            key = self.key_func(event)
+        with self.__cond:
+            if not block and self.overflow_policy == OverflowPolicy.BLOCK and len(self.__queue) >= self.maxsize:
+                return None
+            self.__count(key, "received")
+            if len(self.__queue) >= self.maxsize:
+                if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                    self.__count(key, "dropped")
+                    return False
+                elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                    old_key, old_event = self.__queue.popleft()
+                    self.__count(old_key, "dropped")
+                else:
+                    while len(self.__queue) >= self.maxsize:
+                        self.__cond.wait()
+            self.__queue.append((key, event))
+            self.__cond.notify_all()
+        return True
+
+    def __worker(self):
+        while True:
+            with self.__cond:
+                while not self.__queue:
+                    self.__cond.wait()
+                key, event = self.__queue.popleft()
+                # wake up producers blocked on a full queue
+                self.__cond.notify_all()
+            counter = "dispatched"
+            try:
+                self.handler(event)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+                counter = "failed"
+            with self.__cond:
+                self.__count(key, counter)
+
+    def qsize(self):
+        return len(self.__queue)
+
+    def get_stats(self):
+        with self.__cond:
+            stats = dict(self.__stats)
+            stats["queued"] = len(self.__queue)
+            stats["by_key"] = {key: dict(key_stats) for key, key_stats in self.__stats_by_key.items()}
+        return stats
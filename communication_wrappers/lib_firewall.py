@@ -0,0 +1,144 @@
+import abc
+import ipaddress
+import logging
+import subprocess
+import time
+
+
+class FirewallBackend():
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def list_rules(self, family):
+        """
+        Return the rules of the filter table in iptables-save format (e.g. "-A INPUT -j ACCEPT")
+        """
+        return
+
+    @abc.abstractmethod
+    def apply(self, family, rules):
+        """
+        Apply a list of rules to the filter table in a single transaction
+        """
+        return
+
+
+class IptablesRestoreBackend(FirewallBackend):
+
+    COMMANDS = {
+        4: ("iptables-save", "iptables-restore"),
+        6: ("ip6tables-save", "ip6tables-restore")
+    }
+
+    def __init__(self, use_sudo=True):
+        self.log = logging.getLogger('IptablesRestoreBackend')
+        self.prefix = ['sudo'] if use_sudo else []
+
+    def list_rules(self, family):
+        output = subprocess.check_output(self.prefix + [IptablesRestoreBackend.COMMANDS[family][0], '-t', 'filter'], universal_newlines=True)
+        return [line.strip() for line in output.split("\n") if line.startswith("-A ")]
+
+    def apply(self, family, rules):
+        ruleset = "*filter\n" + "\n".join(rules) + "\nCOMMIT\n"
+        restore_process = subprocess.Popen(self.prefix + [IptablesRestoreBackend.COMMANDS[family][1], '--noflush'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        out, err = restore_process.communicate(ruleset)
+        if restore_process.returncode != 0:
+            self.log.fatal("Could not apply firewall rules: %s", err.strip())
+            raise subprocess.CalledProcessError(restore_process.returncode, IptablesRestoreBackend.COMMANDS[family][1], output=out)
+
+
+class DryRunFirewallBackend(FirewallBackend):
+
+    def __init__(self, existing_rules=None):
+        self.log = logging.getLogger('DryRunFirewallBackend')
+        self.existing_rules = {4: [], 6: []}
+        if existing_rules is not None:
+            self.existing_rules.update(existing_rules)
+        self.applied_rules = {4: [], 6: []}
+
+    def list_rules(self, family):
+        return list(self.existing_rules[family])
+
+    def apply(self, family, rules):
+        for rule in rules:
+            self.log.info("ipv%d: %s", family, rule)
+        self.applied_rules[family].extend(rules)
+
+
+class TunslipFirewall():
+    """
+    Collects the firewall rules of all tunslip interfaces and applies them in one
+    transaction per address family (one save and one restore call each) instead of
+    a check and insert command per rule and per node.
+    """
+
+    # (family, chain, insert at top, rule specification)
+    NODE_RULES = [
+        (6, "INPUT", True, "-d {} -j ACCEPT"),
+        (6, "OUTPUT", True, "-s {} -j ACCEPT")
+    ]
+    SHARED_RULES = [
+        (6, "OUTPUT", False, "-o tun+ -j DROP"),
+        (6, "FORWARD", False, "-o tun+ -j DROP"),
+        (6, "FORWARD", False, "-i tun+ -j DROP"),
+        (4, "OUTPUT", False, "-o tun+ -j DROP")
+    ]
+
+    def __init__(self, backend=None):
+        self.log = logging.getLogger('TunslipFirewall')
+        if backend is not None:
+            self.backend = backend
+        else:
+            self.backend = IptablesRestoreBackend()
+        self.__rules = []
+        self.__num_nodes = 0
+
+    def add_node(self, tunslip_ip_addr):
+        # normalize to the notation used by iptables-save, e.g. fd00:c:1::/64
+        network = str(ipaddress.ip_network(tunslip_ip_addr, strict=False))
+        for family, chain, insert, spec in TunslipFirewall.NODE_RULES:
+            self.__add_rule(family, chain, insert, spec.format(network))
+        for family, chain, insert, spec in TunslipFirewall.SHARED_RULES:
+            self.__add_rule(family, chain, insert, spec)
+        self.__num_nodes += 1
+
+    def __add_rule(self, family, chain, insert, spec):
+        rule = (family, chain, insert, spec)
+        if rule not in self.__rules:
+            self.__rules.append(rule)
+
+    def get_rules(self, family):
+        ret = []
+        for rule_family, chain, insert, spec in self.__rules:
+            if rule_family == family:
+                if insert:
+                    ret.append("-I " + chain + " 1 " + spec)
+                else:
+                    ret.append("-A " + chain + " " + spec)
+        return ret
+
+    def apply(self):
+        start_time = time.time()
+        num_commands = 0
+        num_applied = 0
+        for family in (6, 4):
+            existing = set(self.backend.list_rules(family))
+            num_commands += 1
+            missing = []
+            for rule_family, chain, insert, spec in self.__rules:
+                if rule_family == family and ("-A " + chain + " " + spec) not in existing:
+                    if insert:
+                        missing.append("-I " + chain + " 1 " + spec)
+                    else:
+                        missing.append("-A " + chain + " " + spec)
+            if missing:
+                self.backend.apply(family, missing)
+                num_commands += 1
+                num_applied += len(missing)
+        # every rule used to be checked with a separate command, followed by an insert if missing
+        legacy_commands = self.__num_nodes * (len(TunslipFirewall.NODE_RULES) + len(TunslipFirewall.SHARED_RULES)) + num_applied
+        self.log.info("Applied %d firewall rules for %d nodes in %.3f s using %d commands instead of %d",
+                      num_applied, self.__num_nodes, time.time() - start_time, num_commands, legacy_commands)
+        self.__rules = []
+        self.__num_nodes = 0
+        return num_applied
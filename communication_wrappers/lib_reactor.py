@@ -0,0 +1,121 @@
+import logging
+import os
+import selectors
+import threading
+import traceback
+import sys
+
+
+class LineReader():
+    """
+    Splits a byte stream delivered in arbitrary chunks into text lines
+    """
+
+    def __init__(self, line_cb, max_line_len=1024):
+        self.line_cb = line_cb
+        self.max_line_len = max_line_len
+        self.__buf = bytearray()
+
+    def feed(self, chunk):
+        self.__buf.extend(chunk)
+        if b'\n' not in chunk and len(self.__buf) < self.max_line_len:
+            return
+        lines = self.__buf.split(b'\n')
+        self.__buf = lines.pop()
+        if len(self.__buf) >= self.max_line_len:
+            lines.append(self.__buf)
+            self.__buf = bytearray()
+        for line in lines:
+            line = line.decode(errors="replace").strip()
+            if line:
+                self.line_cb(line)
+
+
+class IOReactor():
+    """
+    Single selector (epoll on Linux) based I/O loop servicing the pipes and serial
+    ports of all nodes from one thread. Every registered file descriptor has a read
+    callback that is called with the chunks read from it.
+    """
+    instance = None
+    __instance_lock = threading.Lock()
+
+    READ_SIZE = 4096
+
+    def __init__(self):
+        self.log = logging.getLogger('IOReactor')
+        self.selector = selectors.DefaultSelector()
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__wakeup_r, self.__wakeup_w = os.pipe()
+        os.set_blocking(self.__wakeup_r, False)
+        self.selector.register(self.__wakeup_r, selectors.EVENT_READ, None)
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @classmethod
+    def get_instance(cls):
+        with cls.__instance_lock:
+            if cls.instance is None:
+                cls.instance = IOReactor()
+        return cls.instance
+
+    def register(self, fileobj, read_cb, close_cb=None):
+        """
+        Call read_cb with every chunk read from fileobj, close_cb is called on end of file.
+        Callbacks run on the reactor thread and must not block.
+        """
+        self.__modify(("register", fileobj, (read_cb, close_cb)))
+
+    def unregister(self, fileobj):
+        self.__modify(("unregister", fileobj, None))
+
+    def __modify(self, request):
+        # the selector is only touched from the reactor thread, wake it up to apply the change
+        with self.__lock:
+            self.__pending.append(request)
+        os.write(self.__wakeup_w, b'\0')
+
+    def __apply_pending(self):
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = []
+        for action, fileobj, callbacks in pending:
+            try:
+                if action == "register":
+                    self.selector.register(fileobj, selectors.EVENT_READ, callbacks)
+                else:
+                    self.selector.unregister(fileobj)
+            except (KeyError, ValueError) as e:
+                self.log.info("could not %s %s: %s", action, fileobj, e)
+
+    def num_registered(self):
+        return len(self.selector.get_map()) - 1
+
+    def __run(self):
+        while True:
+            for key, mask in self.selector.select():
+                if key.data is None:
+                    try:
+                        os.read(self.__wakeup_r, 512)
+                    except BlockingIOError:
+                        pass
+                    self.__apply_pending()
+                    continue
+                read_cb, close_cb = key.data
+                try:
+                    chunk = os.read(key.fd, IOReactor.READ_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    self.selector.unregister(key.fileobj)
+                    if close_cb is not None:
+                        close_cb()
+                    continue
+                try:
+                    read_cb(chunk)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
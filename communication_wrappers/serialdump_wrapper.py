@@ -1,49 +1,163 @@
 import socket
 import subprocess
-import threading
 import logging
 import base64
 import ctypes
 import binascii
-import traceback
-import sys
 from ctypes import *
 import struct
-from communication_wrappers.lib_communication_wrapper import CommunicationWrapper
+from communication_wrappers.lib_communication_wrapper import CommunicationWrapper, BaudrateRegistry
+from communication_wrappers.lib_console import ConsoleBuffer
+from communication_wrappers.lib_reactor import IOReactor
+from communication_wrappers.lib_event_queue import EventQueue, OverflowPolicy
 
 
 class SerialHeader(Structure):
     _fields_ = [("decoded_len",c_ubyte),("encoded_len",c_ubyte),("padding",c_ubyte * 8)]
 
 
+class SerialdumpFrameDecoder():
+    """
+    Incremental decoder for the serialdump stream. Accepts arbitrary chunks of bytes
+    and splits them into frames (SerialHeader, base64 payload, newline) and console
+    text lines. Frames are length checked against the header instead of relying on
+    line boundaries, the header itself may contain newline bytes.
+    """
+
+    HEADER_LEN = ctypes.sizeof(SerialHeader)
+    PADDING = b'FFFFFFFF'
+    MAX_LINE_LEN = 1024
+
+    STATE_LINE_START = 0
+    STATE_FRAME = 1
+    STATE_TEXT = 2
+
+    def __init__(self, frame_cb, text_cb):
+        self.frame_cb = frame_cb
+        self.text_cb = text_cb
+        self.num_frames = 0
+        self.num_errors = 0
+        self.num_text_lines = 0
+        self.__buf = bytearray()
+        self.__state = SerialdumpFrameDecoder.STATE_LINE_START
+        self.__frame_len = 0
+
+    def feed(self, chunk):
+        buf = self.__buf
+        buf.extend(chunk)
+        pos = 0
+        while True:
+            if self.__state == SerialdumpFrameDecoder.STATE_LINE_START:
+                avail = min(len(buf) - pos, SerialdumpFrameDecoder.HEADER_LEN)
+                if avail > 2 and buf[pos + 2:pos + avail] != SerialdumpFrameDecoder.PADDING[:avail - 2]:
+                    self.__state = SerialdumpFrameDecoder.STATE_TEXT
+                elif avail < SerialdumpFrameDecoder.HEADER_LEN:
+                    break
+                elif buf[pos + 1] < SerialdumpFrameDecoder.HEADER_LEN:
+                    self.__error()
+                else:
+                    self.__frame_len = buf[pos + 1]
+                    self.__state = SerialdumpFrameDecoder.STATE_FRAME
+            elif self.__state == SerialdumpFrameDecoder.STATE_FRAME:
+                if len(buf) - pos <= self.__frame_len:
+                    break
+                if buf[pos + self.__frame_len] != 0x0a:
+                    # length does not match, resynchronize on the next line
+                    self.__error()
+                    continue
+                self.__decode_frame(buf[pos], memoryview(buf)[pos + SerialdumpFrameDecoder.HEADER_LEN:pos + self.__frame_len])
+                pos += self.__frame_len + 1
+                self.__state = SerialdumpFrameDecoder.STATE_LINE_START
+            else:
+                end = buf.find(b'\n', pos)
+                if end == -1:
+                    if len(buf) - pos > SerialdumpFrameDecoder.MAX_LINE_LEN:
+                        end = len(buf)
+                    else:
+                        break
+                self.num_text_lines += 1
+                self.text_cb(buf[pos:end].decode(errors="replace").strip())
+                pos = end + 1
+                self.__state = SerialdumpFrameDecoder.STATE_LINE_START
+        del buf[:pos]
+
+    def __decode_frame(self, decoded_len, encoded):
+        # the decoded bytes are immutable, the frame can be queued and kept by the receiver without a copy
+        try:
+            frame = binascii.a2b_base64(encoded)
+        except (binascii.Error, ValueError):
+            self.num_errors += 1
+            self.frame_cb(1, None)
+            return
+        if len(frame) + SerialdumpFrameDecoder.HEADER_LEN != decoded_len:
+            self.num_errors += 1
+            self.frame_cb(1, None)
+            return
+        self.num_frames += 1
+        self.frame_cb(0, frame)
+
+    def __error(self):
+        self.num_errors += 1
+        self.frame_cb(1, None)
+        self.__state = SerialdumpFrameDecoder.STATE_TEXT
+
+
 class SerialdumpWrapper(CommunicationWrapper):
 
     fm_serial_header = struct.Struct('B B')
+    # the encoded length (header + base64) must fit in the single byte of the serial header
+    MTU = (255 - ctypes.sizeof(SerialHeader)) // 4 * 3
 
-    def __init__(self, serial_dev, interface):
+    def __init__(self, serial_dev, interface, baudrate=None, console_size=1000, console_log_rate=10, rx_queue_size=1024):
         self.log = logging.getLogger('SerialdumpWrapper.' + serial_dev)
+        self.mtu = SerialdumpWrapper.MTU
+        self.console = ConsoleBuffer('SerialdumpWrapper.' + serial_dev, console_size, console_log_rate)
         self.__interface = interface
         self.__serial_dev = serial_dev
+        if baudrate is None:
+            baudrate = BaudrateRegistry.get(serial_dev)
+        self.baudrate = int(baudrate)
         if socket.gethostname().find("wilab2") == -1:
-            self.serialdump_process = subprocess.Popen(['../../agent_modules/contiki/communication_wrappers/bin/serialdump-linux','-b115200', serial_dev], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            self.serialdump_process = subprocess.Popen(['../../agent_modules/contiki/communication_wrappers/bin/serialdump-linux','-b' + str(self.baudrate), serial_dev], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         else:
             self.serialdump_process = subprocess.Popen(['sudo', '../../agent_modules/contiki/communication_wrappers/bin/serialdump-linux',
-                                                        '-b115200', '/dev/rm090'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        self.__rx_thread = None
+                                                        '-b' + str(self.baudrate), '/dev/rm090'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         self.__rx_callback = None
-        self.__thread_stop = None
+        self.decoder = None
+        # the reactor thread only reads and decodes, the frames are handed to the rx callback by a worker of this node
+        self.__rx_queue = EventQueue(self.__deliver_frame, rx_queue_size, OverflowPolicy.DROP_OLDEST, 1, None, serial_dev)
+
+    def __deliver_frame(self, frame):
+        self.__rx_callback(*frame)
+
+    def __queue_frame(self, error, frame):
+        self.__rx_queue.put((error, frame))
+
+    def get_rx_stats(self):
+        return self.__rx_queue.get_stats()
+
+    def get_baudrate(self):
+        return self.baudrate
+
+    def get_link_stats(self):
+        # the serialdump framing has no checksum nor sequence numbers, only malformed frames are counted
+        stats = {"framing_errors": 0, "frames": 0, "text_lines": 0, "baudrate": self.baudrate}
+        if self.decoder is not None:
+            stats["framing_errors"] = self.decoder.num_errors
+            stats["frames"] = self.decoder.num_frames
+            stats["text_lines"] = self.decoder.num_text_lines
+        return stats
 
     def print_byte_array(self, b):
         print(' '.join('{:02x}'.format(x) for x in b))
 
     def set_rx_callback(self, rx_callback):
-        if self.__rx_thread is not None:
-            self.__thread_stop.set()
-        self.__thread_stop = threading.Event()
+        reactor = IOReactor.get_instance()
+        if self.__rx_callback is not None:
+            reactor.unregister(self.serialdump_process.stdout)
         self.__rx_callback = rx_callback
-        self.__rx_thread = threading.Thread(target=self.__serial_listen, args=(self.__rx_callback, self.__thread_stop,))
-        self.__rx_thread.daemon = True
-        self.__rx_thread.start()
+        self.decoder = SerialdumpFrameDecoder(self.__queue_frame, self.console.append)
+        reactor.register(self.serialdump_process.stdout, self.decoder.feed)
 
     def send(self, payload):
         payload_len = len(payload)
@@ -61,20 +175,5 @@ class SerialdumpWrapper(CommunicationWrapper):
         msg.append(0x0a)
         #self.log.info("full encoded line %s%s",bytearray(serial_hdr).decode(), binascii.b2a_base64(payload))
         #self.print_byte_array(msg)
-        self.serialdump_process.stdin.write(msg.decode(encoding="utf-8", errors="ignore"))
+        self.serialdump_process.stdin.write(msg)
         self.serialdump_process.stdin.flush()
-
-    def __serial_listen(self, rx_callback, stop_event):
-        while not stop_event.is_set():
-            line = self.serialdump_process.stdout.readline().strip()
-            if line != '':
-                if line[2:ctypes.sizeof(SerialHeader)] == 'FFFFFFFF':
-                    try:
-                        enc_len = fm_serial_header.unpack(bytearray(line[0:2], 'utf-8', errors="ignore"))[1]
-                        dec_line = base64.b64decode(line[ctypes.sizeof(SerialHeader):enc_len])
-                        rx_callback(0, bytearray(dec_line))
-                    except (RuntimeError, TypeError, NameError):
-                        rx_callback(1, None)
-                        traceback.print_exc(file=sys.stdout)
-                else:
-                    self.log.info("PRINTF: %s", line)
@@ -0,0 +1,387 @@
+import collections
+import errno
+import logging
+import struct
+import threading
+import time
+import serial
+import crc16
+from enum import IntEnum
+from communication_wrappers.lib_communication_wrapper import CommunicationWrapper, BaudrateRegistry, HIGH_BAUDRATES
+from communication_wrappers.lib_console import ConsoleBuffer
+from communication_wrappers.lib_reactor import IOReactor
+from communication_wrappers.lib_event_queue import EventQueue, OverflowPolicy
+
+SLIP_END = b'\xc0'
+SLIP_ESC = b'\xdb'
+SLIP_ESC_END = b'\xdb\xdc'
+SLIP_ESC_ESC = b'\xdb\xdd'
+# printable ASCII and whitespace, a frame never starts with one of these (see SLIPSerialWrapper frame types)
+TEXT_BYTES = bytes(range(0x20, 0x7f)) + b'\t\r\n'
+
+
+def slip_encode(payload):
+    """
+    Encode a payload as a SLIP frame (RFC 1055), the frame is delimited by END on both sides
+    """
+    return SLIP_END + bytes(payload).replace(SLIP_ESC, SLIP_ESC_ESC).replace(SLIP_END, SLIP_ESC_END) + SLIP_END
+
+
+class SLIPDecoder():
+    """
+    Incremental SLIP decoder, accepts arbitrary chunks of the byte stream and
+    returns the complete frames. Frames with invalid escapes or exceeding
+    max_frame_len are returned as None.
+
+    With a text_cb, data outside frames that consists of text only (firmware printf
+    output on the same UART) is handed to text_cb line by line instead of being
+    returned as a frame.
+    """
+
+    def __init__(self, max_frame_len=2048, text_cb=None):
+        self.max_frame_len = max_frame_len
+        self.text_cb = text_cb
+        self.num_frames = 0
+        self.num_errors = 0
+        self.num_text_lines = 0
+        self.__buf = bytearray()
+        self.__discarding = False
+
+    def feed(self, chunk):
+        frames = []
+        self.__buf.extend(chunk)
+        if SLIP_END in chunk:
+            segments = self.__buf.split(SLIP_END)
+            self.__buf = segments.pop()
+            if self.__discarding:
+                segments[0] = bytearray()
+                self.__discarding = False
+            for segment in segments:
+                if not segment:
+                    continue
+                if self.__is_text(segment):
+                    self.__text(segment)
+                else:
+                    frames.append(self.__unescape(segment))
+        elif self.__discarding:
+            self.__buf = bytearray()
+            return frames
+        if self.__is_text(self.__buf):
+            # console output not followed by a frame yet, pass on the complete lines
+            end = self.__buf.rfind(b'\n') if len(self.__buf) <= self.max_frame_len else len(self.__buf)
+            if end != -1:
+                self.__text(self.__buf[:end])
+                del self.__buf[:end + 1]
+        elif len(self.__buf) > 2 * self.max_frame_len + 2:
+            # no frame end in sight, drop everything up to the next END
+            self.num_errors += 1
+            self.__discarding = True
+            self.__buf = bytearray()
+            frames.append(None)
+        return frames
+
+    def __is_text(self, segment):
+        return self.text_cb is not None and len(segment) > 0 and not segment.translate(None, TEXT_BYTES)
+
+    def __text(self, segment):
+        for line in segment.decode(errors="replace").splitlines():
+            line = line.strip()
+            if line:
+                self.num_text_lines += 1
+                self.text_cb(line)
+
+    def __unescape(self, segment):
+        # every ESC must start an ESC_END or ESC_ESC sequence
+        if segment.count(SLIP_ESC) != segment.count(SLIP_ESC_END) + segment.count(SLIP_ESC_ESC) or segment.endswith(SLIP_ESC):
+            self.num_errors += 1
+            return None
+        frame = segment.replace(SLIP_ESC_END, SLIP_END).replace(SLIP_ESC_ESC, SLIP_ESC)
+        if len(frame) > self.max_frame_len:
+            self.num_errors += 1
+            return None
+        self.num_frames += 1
+        return frame
+
+    def reset(self):
+        self.__buf = bytearray()
+        self.__discarding = False
+
+
+class LinkControl(IntEnum):
+    BAUD_REQUEST = 0
+    BAUD_ACK = 1
+    BAUD_NACK = 2
+    PROBE = 3
+    PROBE_ACK = 4
+    NACK = 5
+    RESET = 6
+
+
+class SLIPSerialWrapper(CommunicationWrapper):
+    """
+    In-process serial transport using binary SLIP framing, the payload is sent
+    as is without a helper process or base64 encoding.
+
+    Every frame carries a type, a sequence number and a CRC16 (XMODEM) trailer.
+    A corrupted, lost or malformed frame is answered with a NACK holding the next
+    expected sequence number, after which the peer retransmits its frames from
+    that number on, so a noisy link costs a frame time instead of a command timeout.
+
+    LINK_CONTROL frames are handled by the transport itself, besides NACKs they are
+    used for the link speed handshake: a BAUD_REQUEST for a new rate is sent at the
+    current rate, the node answers with BAUD_ACK (or BAUD_NACK) and switches, after
+    which a PROBE at the new rate must be answered by a PROBE_ACK without errors.
+    Otherwise both sides fall back to the previous rate.
+
+    A RESET announces that the sender restarted its sequence numbers at its value,
+    it is sent when the wrapper is created and makes the receiver forget its
+    expected sequence number. A peer rebooting without a RESET is detected as well:
+    a frame behind the expected number only counts as a duplicate if its CRC
+    matches the frame delivered under that number.
+
+    Text between frames (firmware printf output) goes to the console buffer, it is
+    neither counted as an error nor answered with a NACK.
+
+    With an rx callback set (CustomNode) every DATA frame is handed to it. Without
+    one the wrapper backs an RPCNode: send waits for the response frame and returns
+    it, EVENT frames are passed to the event callback.
+    """
+
+    FRAME_DATA = 0x00
+    FRAME_EVENT = 0x01
+    FRAME_LINK_CONTROL = 0xff
+    fm_frame_header = struct.Struct('<B B')
+    fm_frame_crc = struct.Struct('<H')
+    fm_link_control = struct.Struct('<B I')
+    # number of sent frames kept for retransmission, also the sequence window
+    HISTORY_LEN = 16
+    # a NACK is repeated after NACK_INTERVAL, after RESYNC_TIMEOUT the missing frames are given up
+    NACK_INTERVAL = 0.1
+    RESYNC_TIMEOUT = 1.0
+    # seconds send waits for the response of an RPC request
+    RESPONSE_TIMEOUT = 2.0
+
+    def __init__(self, serial_dev, interface, baudrate=None, max_frame_len=2048, rx_queue_size=1024, console_size=1000, console_log_rate=10, response_timeout=RESPONSE_TIMEOUT):
+        self.log = logging.getLogger('SLIPSerialWrapper.' + serial_dev)
+        self.console = ConsoleBuffer('SLIPSerialWrapper.' + serial_dev, console_size, console_log_rate)
+        self.__interface = interface
+        self.__serial_dev = serial_dev
+        if baudrate is None:
+            baudrate = BaudrateRegistry.get(serial_dev)
+        self.serial_port = serial.Serial(serial_dev, baudrate, timeout=0.1)
+        self.decoder = SLIPDecoder(max_frame_len, self.console.append)
+        self.mtu = max_frame_len - SLIPSerialWrapper.fm_frame_header.size - SLIPSerialWrapper.fm_frame_crc.size
+        self.__tx_lock = threading.Lock()
+        self.__tx_seq = 0
+        self.__tx_history = collections.deque(maxlen=SLIPSerialWrapper.HISTORY_LEN)
+        self.__rx_seq = None
+        self.__rx_crcs = {}
+        self.__nack_seq = None
+        self.__nack_time = 0
+        self.__nack_since = 0
+        self.__rx_callback = None
+        self.event_cb = None
+        self.response_timeout = response_timeout
+        self.__request_lock = threading.Lock()
+        self.__response_cond = threading.Condition()
+        self.__response = None
+        self.__link_cond = threading.Condition()
+        self.__link_reply = None
+        self.__stats = {"crc_errors": 0, "framing_errors": 0, "duplicates": 0, "nacks_sent": 0, "nacks_received": 0, "retransmissions": 0, "resets": 0}
+        # the reactor thread only reads and unframes, sequencing, NACKs, retransmissions and the
+        # rx callback run on a worker of this node, a lost frame is recovered by a NACK
+        self.__rx_queue = EventQueue(self.__on_frame, rx_queue_size, OverflowPolicy.DROP_OLDEST, 1, None, serial_dev)
+        IOReactor.get_instance().register(self.serial_port, self.__on_data)
+        self.__send_link_control(LinkControl.RESET, self.__tx_seq)
+
+    def print_byte_array(self, b):
+        print(' '.join('{:02x}'.format(x) for x in b))
+
+    def set_rx_callback(self, rx_callback):
+        self.__rx_callback = rx_callback
+
+    def add_event_callback(self, cb):
+        """
+        cb(payload, block=True) is called with the payload of every EVENT frame of the node,
+        from the rx worker of the wrapper
+        """
+        self.event_cb = cb
+
+    def send(self, payload):
+        """
+        Without an rx callback, wait for the response frame and return its payload
+        """
+        if self.__rx_callback is not None:
+            self.__send_data(payload)
+            return None
+        with self.__request_lock:
+            with self.__response_cond:
+                self.__response = None
+            self.__send_data(payload)
+            with self.__response_cond:
+                if not self.__response_cond.wait_for(lambda: self.__response is not None, self.response_timeout):
+                    raise TimeoutError(errno.ETIMEDOUT, "No response on " + self.__serial_dev)
+                return self.__response
+
+    def __send_data(self, payload):
+        with self.__tx_lock:
+            frame = self.__create_frame(SLIPSerialWrapper.FRAME_DATA, self.__tx_seq, payload)
+            self.__tx_history.append((self.__tx_seq, frame))
+            self.__tx_seq = (self.__tx_seq + 1) & 0xff
+            self.serial_port.write(frame)
+
+    def __create_frame(self, frame_type, seq, payload):
+        frame = bytearray(SLIPSerialWrapper.fm_frame_header.pack(frame_type, seq))
+        frame.extend(payload)
+        frame.extend(SLIPSerialWrapper.fm_frame_crc.pack(crc16.crc16xmodem(bytes(frame))))
+        return slip_encode(frame)
+
+    def get_baudrate(self):
+        return self.serial_port.baudrate
+
+    def get_link_stats(self):
+        stats = dict(self.__stats)
+        stats["frames"] = self.decoder.num_frames
+        stats["text_lines"] = self.decoder.num_text_lines
+        stats["baudrate"] = self.serial_port.baudrate
+        return stats
+
+    def negotiate_baudrate(self, baudrates=HIGH_BAUDRATES, timeout=0.5):
+        """
+        Try to switch the link to the highest of the given rates the node accepts,
+        returns the rate the link is running at afterwards.
+        """
+        base_rate = self.serial_port.baudrate
+        for baudrate in sorted(baudrates, reverse=True):
+            if baudrate <= base_rate:
+                continue
+            reply = self.__link_request(LinkControl.BAUD_REQUEST, baudrate, timeout)
+            if reply is None:
+                self.log.info("No link control support on %s, staying at %d baud", self.__serial_dev, base_rate)
+                break
+            if reply[0] != LinkControl.BAUD_ACK or reply[1] != baudrate:
+                continue
+            self.serial_port.baudrate = baudrate
+            num_errors = self.__stats["crc_errors"] + self.__stats["framing_errors"]
+            reply = self.__link_request(LinkControl.PROBE, baudrate, timeout)
+            if reply is not None and reply[0] == LinkControl.PROBE_ACK and self.__stats["crc_errors"] + self.__stats["framing_errors"] == num_errors:
+                BaudrateRegistry.set(self.__serial_dev, baudrate)
+                return baudrate
+            self.log.info("Framing errors at %d baud on %s, falling back", baudrate, self.__serial_dev)
+            # ask the node to return to the base rate in case it did receive the probe
+            self.__send_link_control(LinkControl.BAUD_REQUEST, base_rate)
+            self.serial_port.baudrate = base_rate
+            self.decoder.reset()
+            time.sleep(timeout)
+        BaudrateRegistry.set(self.__serial_dev, base_rate)
+        return base_rate
+
+    def __send_link_control(self, control_type, value):
+        # link control frames are not sequenced nor retransmitted
+        frame = self.__create_frame(SLIPSerialWrapper.FRAME_LINK_CONTROL, 0, SLIPSerialWrapper.fm_link_control.pack(control_type, value))
+        with self.__tx_lock:
+            self.serial_port.write(frame)
+
+    def __link_request(self, control_type, value, timeout):
+        with self.__link_cond:
+            self.__link_reply = None
+            self.__send_link_control(control_type, value)
+            self.__link_cond.wait_for(lambda: self.__link_reply is not None, timeout)
+            return self.__link_reply
+
+    def __request_retransmission(self):
+        # the peer resends everything from the missing frame on, so do not repeat the NACK right away
+        if self.__rx_seq is None:
+            return
+        now = time.monotonic()
+        if self.__nack_seq == self.__rx_seq:
+            if now - self.__nack_time < SLIPSerialWrapper.NACK_INTERVAL:
+                return
+        else:
+            self.__nack_seq = self.__rx_seq
+            self.__nack_since = now
+        self.__nack_time = now
+        self.__stats["nacks_sent"] += 1
+        self.__send_link_control(LinkControl.NACK, self.__rx_seq)
+
+    def __reset_rx(self):
+        self.__rx_seq = None
+        self.__rx_crcs.clear()
+        self.__nack_seq = None
+
+    def __retransmit(self, seq):
+        self.__stats["nacks_received"] += 1
+        with self.__tx_lock:
+            frames = [frame for frame_seq, frame in self.__tx_history if (frame_seq - seq) & 0xff < SLIPSerialWrapper.HISTORY_LEN]
+            for frame in frames:
+                self.serial_port.write(frame)
+        if frames:
+            self.__stats["retransmissions"] += len(frames)
+        else:
+            self.log.info("NACK for frame %d which is no longer available", seq)
+
+    def get_rx_stats(self):
+        return self.__rx_queue.get_stats()
+
+    def __on_data(self, chunk):
+        for frame in self.decoder.feed(chunk):
+            self.__rx_queue.put(frame)
+
+    def __on_frame(self, frame):
+        if frame is None:
+            self.__stats["framing_errors"] += 1
+            self.__request_retransmission()
+            return
+        if len(frame) < SLIPSerialWrapper.fm_frame_header.size + SLIPSerialWrapper.fm_frame_crc.size:
+            self.__stats["crc_errors"] += 1
+            self.__request_retransmission()
+            return
+        crc = SLIPSerialWrapper.fm_frame_crc.unpack_from(frame, len(frame) - 2)[0]
+        if crc16.crc16xmodem(bytes(frame[:-2])) != crc:
+            self.__stats["crc_errors"] += 1
+            self.__request_retransmission()
+            return
+        frame_type, seq = SLIPSerialWrapper.fm_frame_header.unpack_from(frame)
+        payload = frame[SLIPSerialWrapper.fm_frame_header.size:-2]
+        if frame_type == SLIPSerialWrapper.FRAME_LINK_CONTROL:
+            if len(payload) == SLIPSerialWrapper.fm_link_control.size:
+                control_type, value = SLIPSerialWrapper.fm_link_control.unpack(payload)
+                if control_type == LinkControl.NACK:
+                    self.__retransmit(value)
+                elif control_type == LinkControl.RESET:
+                    self.log.info("Peer reset its sequence numbers to %d", value)
+                    self.__stats["resets"] += 1
+                    self.__reset_rx()
+                else:
+                    with self.__link_cond:
+                        self.__link_reply = (control_type, value)
+                        self.__link_cond.notify_all()
+            return
+        if self.__rx_seq is not None and seq != self.__rx_seq:
+            if (self.__rx_seq - seq) & 0xff <= SLIPSerialWrapper.HISTORY_LEN:
+                if self.__rx_crcs.get(seq) == crc:
+                    # already delivered, the peer went back further than needed
+                    self.__stats["duplicates"] += 1
+                    return
+                # a different frame under an old number, the peer restarted without a RESET
+                self.log.info("Peer restarted its sequence numbers at frame %d", seq)
+                self.__stats["resets"] += 1
+                self.__reset_rx()
+            elif (seq - self.__rx_seq) & 0xff < SLIPSerialWrapper.HISTORY_LEN and \
+                    (self.__nack_seq != self.__rx_seq or time.monotonic() - self.__nack_since < SLIPSerialWrapper.RESYNC_TIMEOUT):
+                # a frame went missing, drop the later ones until it is resent
+                self.__request_retransmission()
+                return
+            else:
+                self.log.info("Resynchronizing sequence numbers at frame %d", seq)
+        self.__rx_seq = (seq + 1) & 0xff
+        self.__rx_crcs[seq] = crc
+        self.__nack_seq = None
+        if frame_type == SLIPSerialWrapper.FRAME_EVENT and self.event_cb is not None:
+            self.event_cb(payload)
+        elif self.__rx_callback is not None:
+            self.__rx_callback(0, payload)
+        elif frame_type == SLIPSerialWrapper.FRAME_DATA:
+            with self.__response_cond:
+                self.__response = payload
+                self.__response_cond.notify_all()
@@ -18,6 +18,7 @@ class BaseConnectorModule(wishful_module.AgentModule):
         self.protocol_attributes = kwargs['ControlAttributes']
         self.protocol_functions = kwargs['ControlFunctions']
         self.protocol_connectors = kwargs['ProtocolConnectors']
+        self.protocol_connector_ids = set(self.protocol_connectors.values())
 
     @wishful_module.on_start()
     def start_contiki_connector(self):
@@ -35,19 +36,11 @@ class BaseConnectorModule(wishful_module.AgentModule):
         pass
 
     def get_attr_by_key(self, node, attr_type, attr_key):
-        attr = None
-        for connector_name, connector_id in self.protocol_connectors.items():
-            if attr_type == 'parameter':
-                attr = node.get_parameter(connector_id, attr_key)
-            elif attr_type == 'event':
-                attr = node.get_event(connector_id, attr_key)
-            elif attr_type == 'measurement':
-                attr = node.get_measurement(connector_id, attr_key)
-            if attr is not None:
-                return attr
-        if attr is None:
-            self.log.info("Attr %s not found", attr_key)
-        return None
+        entry = node.find_attr(attr_type, attr_key, self.protocol_connector_ids)
+        if entry is None:
+            self.log.debug("Attr %s not found", attr_key)
+            return None
+        return entry[1]
 
     def create_attribute_list_from_keys(self, node, attr_key_list, attr_type):
         if node is not None:
@@ -61,18 +54,11 @@ class BaseConnectorModule(wishful_module.AgentModule):
         raise exceptions.InvalidArgumentException(err_msg="Interface does not exist")
         return None
 
-    def set_parameter(self, parameter_name, parameter_value):
-        import traceback
-        
-        for line in traceback.format_stack():
-            print("<<< >>>", line.strip())
-        
+    def set_parameter(self, parameter_name, parameter_value, confirmed=True):
         param_key_values = {parameter_name: parameter_value}
         node = self.node_factory.get_node(self.interface)
         parameter_list = self.create_attribute_list_from_keys(node, param_key_values.keys(), "parameter")
-        ret = node.set_parameters(parameter_list, param_key_values)
-        print("<<< set_parameter >>>", ret)
-        
+        ret = node.set_parameters(parameter_list, param_key_values, confirmed)
         if type(ret) == dict:
             return ret[parameter_name]
         else:
@@ -18,11 +18,11 @@ class RadioConnectorModule(BaseConnectorModule):
         super(RadioConnectorModule, self).__init__(**kwargs)
 
     @wishful_module.bind_function(upis.radio.set_parameters)
-    def set_radio_parameter(self, param_key_values_dict):
+    def set_radio_parameter(self, param_key_values_dict, confirmed=True):
         node = self.node_factory.get_node(self.interface)
         try:
             param_list = self.create_attribute_list_from_keys(node, param_key_values_dict.keys(), "parameter")
-            return node.set_parameters(param_list, param_key_values_dict)
+            return node.set_parameters(param_list, param_key_values_dict, confirmed)
         except Exception:
             traceback.print_exc(file=sys.stdout)
 
@@ -63,6 +63,8 @@ class RadioConnectorModule(BaseConnectorModule):
         node = self.node_factory.get_node(self.interface)
         try:
             measurement_list = self.create_attribute_list_from_keys(node, measurement_key_list, "measurement")
+            if hasattr(node, "observe_measurements") and node.observe_measurements(measurement_list, collect_period, report_period, num_iterations, report_callback):
+                return
             thread.start_new_thread(self.get_radio_measurements_periodic_worker, (node, measurement_list, collect_period, report_period, num_iterations, report_callback,))
         except:
             traceback.print_exc(file=sys.stdout)
@@ -16,6 +16,8 @@ class GenericConnector(BaseConnectorModule):
 
     def __init__(self, **kwargs):
         super(GenericConnector, self).__init__(**kwargs)
+        # blocks of the file being stored, sent in one blockwise transfer when the last block arrives
+        self.upload_buffer = bytearray()
 
     @wishful_module.bind_function(upis.mgmt.disseminate_radio_program)
     def disseminate_radio_program(self, radio_program_id, radio_program, nodes, source_node=0):
@@ -90,9 +92,37 @@ class GenericConnector(BaseConnectorModule):
         """
         node = self.node_factory.get_node(self.interface)
         # first we need to store the ELF object file on the node
-        # for this purpose we need to divide the file in chunks and send the chunks one by one
+        # for this purpose we need to divide the file in chunks and send the chunks one by one,
+        # unless the node supports a blockwise upload: then the file is sent as one stream after the last chunk
         try:
-            return node.store_file(is_last_block, block_size, block_offset, block_data)
+            if not node.supports_blockwise_upload():
+                return node.store_file(is_last_block, block_size, block_offset, block_data)
+            if block_offset == 0:
+                self.upload_buffer = bytearray()
+            if block_offset != len(self.upload_buffer):
+                self.log.info("store_file: block at offset %d does not follow offset %d", block_offset, len(self.upload_buffer))
+                return -1
+            self.upload_buffer.extend(block_data[0:block_size])
+            if not is_last_block:
+                return 0
+            file_data = bytes(self.upload_buffer)
+            self.upload_buffer = bytearray()
+            return node.upload_file(file_data)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+    def upload_file(self, file_data):
+        """This function stores a complete software module (i.e. ELF object file) on the node in a single call.
+
+        Args:
+            file_data (bytes): Contents of the ELF object file.
+
+        Returns:
+            int: Error value 0 = SUCCESS; -1 = FAIL
+        """
+        node = self.node_factory.get_node(self.interface)
+        try:
+            return node.upload_file(file_data)
         except Exception:
             traceback.print_exc(file=sys.stdout)
 
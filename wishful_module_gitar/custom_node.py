@@ -1,24 +1,32 @@
 import errno
 import logging
+import threading
 import time
 #import binascii
 
 from wishful_module_gitar.lib_gitar import *
 from communication_wrappers.lib_serial import *
+from communication_wrappers.lib_event_queue import EventQueue, OverflowPolicy
 
 
 class CustomNode():
 
-    def __init__(self, serial_dev, mac_addr, ip_addr, interface, serial_wrapper, auto_config=False):
+    def __init__(self, serial_dev, mac_addr, ip_addr, interface, serial_wrapper, auto_config=False, response_timeout=1.0, event_queue_size=256, event_overflow_policy=OverflowPolicy.DROP_OLDEST):
         mod_name = 'ContikiNode.' + interface
         self.log = logging.getLogger(mod_name)
         self.mac_addr = mac_addr
         self.ip_addr = ip_addr
         self.interface = interface
+        self.response_timeout = response_timeout
+        self.__response_cond = threading.Condition()
+        self.__awaiting_command_response = False
+        self.__awaiting_probe_response = False
+        self.__response_message = bytearray()
+        # subscribers run on their own worker, a subscriber sending a command must not block the response it waits for
+        self.event_queue = EventQueue(self.__dispatch_event, event_queue_size, event_overflow_policy, 1, lambda item: item[0].unique_id, interface)
         self.serial_wrapper = serial_wrapper
         self.serial_wrapper.set_rx_callback(self.__serial_rx_handler)
         time.sleep(5)
-        self.__response_message = bytearray()
         self.sequence_number = 0
         if auto_config is True:
             # read params/events/measurements from sensor
@@ -240,14 +248,11 @@ class CustomNode():
         pass
 
     def __await_probe_response(self):
-        wait_time = 0
-        while self.__awaiting_probe_response and wait_time < 1.0:
-            time.sleep(0.1)
-            wait_time += 0.1
-        if self.__awaiting_probe_response:
-            self.__awaiting_probe_response = False
-            self.log.info("ContikiNode %s: probe response timeout", self.interface)
-            return False
+        with self.__response_cond:
+            if not self.__response_cond.wait_for(lambda: not self.__awaiting_probe_response, self.response_timeout):
+                self.__awaiting_probe_response = False
+                self.log.info("ContikiNode %s: probe response timeout", self.interface)
+                return False
         return True
 
     def __send_serial_cmd(self, max_attempts, message, message_hdr):
@@ -255,7 +260,9 @@ class CustomNode():
         response_error = 0
         while num_attempts < max_attempts:
             num_attempts += 1
-            self.__awaiting_command_response = True
+            with self.__response_cond:
+                self.__awaiting_command_response = True
+                self.__response_message = None
             self.serial_wrapper.send(message)
             if self.__await_command_response() and self.__response_message is not None:
                 response_hdr = ControlMsgHeader.from_buf(self.__response_message)
@@ -269,19 +276,29 @@ class CustomNode():
         return response_error
 
     def __await_command_response(self):
-        wait_time = 0
-        while self.__awaiting_command_response and wait_time < 1.0:
-            time.sleep(0.1)
-            wait_time += 0.1
-        if self.__awaiting_command_response:
-            self.__awaiting_command_response = False
-            self.log.info("command response timeout")
-            return False
+        # the rx handler clears the flag and notifies as soon as the response is in
+        with self.__response_cond:
+            if not self.__response_cond.wait_for(lambda: not self.__awaiting_command_response, self.response_timeout):
+                self.__awaiting_command_response = False
+                self.log.info("command response timeout")
+                return False
         return True
 
     def __str__(self):
         return "ContikiNode " + self.interface
 
+    def __dispatch_event(self, item):
+        e, event_msg = item
+        value = e.data_type.value_from_buf(event_msg)
+        for cb in e.subscriber_callbacks:
+            cb(e.unique_name, value)
+
+    def get_event_stats(self):
+        """
+        Returns the received, dispatched, failed, dropped and discarded event counters of the node, also per event uid
+        """
+        return self.event_queue.get_stats()
+
     def __serial_rx_handler(self, error, response_message):
         if error == 0:
             if response_message[0] == CommandOpCode.EVENT_PUSH:
@@ -292,19 +309,26 @@ class CustomNode():
                 for connector in self.events_id_dct.keys():
                     if e_hdr.unique_id in self.events_id_dct[connector]:
                         e = self.events_id_dct[connector][e_hdr.unique_id]
-                        value = e.data_type.value_from_buf(response_message[line_ptr:])
-                        for cb in e.subscriber_callbacks:
-                            cb(e.unique_name, value)
+                        if e.subscriber_callbacks:
+                            self.event_queue.put((e, response_message[line_ptr:]))
+                        else:
+                            self.event_queue.discard((e, None))
                         return
                 self.log.info("ContikiNode %s received unknown event %s %s, dropping", self.interface, event_hdr, e_hdr)
-            elif self.__awaiting_command_response:
-                self.__awaiting_command_response = False
-                self.__response_message = response_message
             else:
+                with self.__response_cond:
+                    if self.__awaiting_command_response:
+                        self.__awaiting_command_response = False
+                        self.__response_message = response_message
+                        self.__response_cond.notify_all()
+                        return
                 self.serial_wrapper.print_byte_array(response_message)
                 self.log.info("ContikiNode %s received response out-of-order, dropping", self.interface)
         else:
             self.log.info("received error message")
-            if self.__awaiting_command_response:
-                self.__awaiting_command_response = False
-                self.__response_message = None
+            with self.__response_cond:
+                if self.__awaiting_command_response:
+                    # wake up the sender so it retransmits immediately
+                    self.__awaiting_command_response = False
+                    self.__response_message = None
+                    self.__response_cond.notify_all()
@@ -16,87 +16,437 @@ class ControlDataType():
         else:
             self.endianness = '>'
 
-        # self.struct_fmt = struct.Struct(self.endianness + self.fmt)
-        self.size = struct.calcsize(self.fmt)
+        self.struct_fmt = self.compile(self.fmt)
+        self.size = self.struct_fmt.size
+
+    def compile(self, fmt):
+        """
+        Precompile a format, the endianness prefix is only added when it differs from the host
+        """
+        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
+            fmt = self.endianness + fmt
+        return struct.Struct(fmt)
 
     def to_bytes(self, *val):
         """
         Transform value(s) to bytes specified by datatype format
         """
-        tmp_fmt = self.fmt
-        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
-            tmp_fmt = self.endianness + self.fmt
-        return struct.pack(tmp_fmt, *val)
+        return self.struct_fmt.pack(*val)
 
     def read_bytes(self, buf):
         """
         Read value(s) from a buffer. Returns a tuple according to the datatype format
         """
-        tmp_fmt = self.fmt
-        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
-            tmp_fmt = self.endianness + self.fmt
-        tpl = struct.unpack_from(tmp_fmt, buf)
+        tpl = self.struct_fmt.unpack_from(buf)
         if len(tpl) == 1:
             tpl = tpl[0]
         return tpl
 
+    def unpack_from(self, buf, offset=0):
+        """
+        Read value(s) from a buffer (e.g. a memoryview) at offset without copying it.
+        Returns the value(s) and the offset following them
+        """
+        tpl = self.struct_fmt.unpack_from(buf, offset)
+        if len(tpl) == 1:
+            tpl = tpl[0]
+        return tpl, offset + self.struct_fmt.size
+
     def has_variable_size(self):
         return False
 
 
 class OpaqueControlDataType(ControlDataType):
+    """
+    Fixed part (fmt) followed by a variable number of sub_fmt elements. All elements
+    are packed and unpacked with a single struct call, the Struct for n elements is
+    cached. With as_array set, decoding returns the fixed values and a NumPy record
+    array of the elements instead of a flat tuple (requires numpy).
+    """
+
+    MAX_CACHED_REPEATS = 64
+
+    NUMPY_TYPES = {"?": "?", "c": "S1", "B": "u1", "b": "i1", "H": "u2", "h": "i2", "I": "u4", "i": "i4",
+                   "f": "f4", "d": "f8", "Q": "u8", "q": "i8"}
 
-    def __init__(self, endianness="", fmt="", sub_fmt=""):
+    def __init__(self, endianness="", fmt="", sub_fmt="", as_array=False):
         super(OpaqueControlDataType, self).__init__(endianness, fmt)
         self.sub_fmt = sub_fmt
+        self.struct_sub_fmt = self.compile(self.sub_fmt)
+        self.as_array = as_array
+        self.__repeated_structs = {}
+        self.__numpy_dtype = None
+
+    def __repeated_struct(self, n):
+        """
+        Struct for n sub_fmt elements, or None when native alignment would pad between elements
+        """
+        if n not in self.__repeated_structs:
+            if len(self.__repeated_structs) >= OpaqueControlDataType.MAX_CACHED_REPEATS:
+                self.__repeated_structs.clear()
+            repeated = self.compile(self.sub_fmt * n)
+            if repeated.size != n * self.struct_sub_fmt.size:
+                repeated = None
+            self.__repeated_structs[n] = repeated
+        return self.__repeated_structs[n]
+
+    def __num_elements(self, num_values):
+        if not self.sub_fmt:
+            return 0
+        return -(-(num_values - len(self.fmt)) // len(self.sub_fmt))
 
     def calcsize(self, *val):
-        size = struct.calcsize(self.fmt)
-        offset = len(self.fmt)
-        while offset < len(val):
-            offset += len(self.sub_fmt)
-            size += struct.calcsize(self.sub_fmt)
-        return size
+        return self.struct_fmt.size + self.__num_elements(len(val)) * self.struct_sub_fmt.size
 
     def to_bytes(self, *val):
         """
         Transform value(s) to bytes specified by datatype format
         """
-        tmp_fmt = self.fmt
-        tmp_subfmt = self.sub_fmt
-        # value = tuple(*val)
-        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
-            tmp_fmt = self.endianness + self.fmt
-            tmp_subfmt = self.endianness + self.sub_fmt
-        b_array = struct.pack(tmp_fmt, *val[0:len(self.fmt)])
-        offset = len(self.fmt)
-        while offset < len(val):
-            b_array = b_array + struct.pack(tmp_subfmt, *val[offset:offset + len(self.sub_fmt)])
-            offset += len(self.sub_fmt)
-        if offset != len(val):
-            print("Too many el for dynamic struct!!")
-        return b_array
+        num_fixed = len(self.fmt)
+        n = self.__num_elements(len(val))
+        if n <= 0:
+            return self.struct_fmt.pack(*val[0:num_fixed])
+        repeated = self.__repeated_struct(n)
+        if repeated is not None:
+            return self.struct_fmt.pack(*val[0:num_fixed]) + repeated.pack(*val[num_fixed:])
+        b_array = bytearray(self.struct_fmt.pack(*val[0:num_fixed]))
+        for offset in range(num_fixed, len(val), len(self.sub_fmt)):
+            b_array.extend(self.struct_sub_fmt.pack(*val[offset:offset + len(self.sub_fmt)]))
+        return bytes(b_array)
 
     def read_bytes(self, buf):
         """
         Read value(s) from a buffer. Returns a tuple according to the datatype format
         """
-        tmp_fmt = self.fmt
-        tmp_subfmt = self.sub_fmt
-        if ControlDataType.to_string_byteorder[self.endianness] != sys.byteorder:
-            tmp_fmt = self.endianness + self.fmt
-            tmp_subfmt = self.endianness + self.sub_fmt
-        tpl = struct.unpack(tmp_fmt, buf[0:struct.calcsize(self.fmt)])
-        offset = struct.calcsize(self.fmt)
-        while offset < len(buf):
-            tpl = tpl + struct.unpack(tmp_subfmt, buf[offset:offset + struct.calcsize(self.sub_fmt)])
-            offset += struct.calcsize(self.sub_fmt)
-        return tpl
+        return self.unpack_from(buf)[0]
+
+    def unpack_from(self, buf, offset=0):
+        """
+        Read the fixed part at offset followed by sub_fmt elements up to the end of the buffer.
+        Returns the values and the offset following them
+        """
+        if self.as_array:
+            fixed, records, offset = self.unpack_array_from(buf, offset)
+            return (fixed, records), offset
+        tpl = self.struct_fmt.unpack_from(buf, offset)
+        offset += self.struct_fmt.size
+        n = self.__num_remaining(buf, offset)
+        if n > 0:
+            repeated = self.__repeated_struct(n)
+            if repeated is not None:
+                tpl = tpl + repeated.unpack_from(buf, offset)
+            else:
+                elements = [self.struct_sub_fmt.unpack_from(buf, offset + i * self.struct_sub_fmt.size) for i in range(n)]
+                tpl = tpl + tuple(value for element in elements for value in element)
+            offset += n * self.struct_sub_fmt.size
+        return tpl, offset
+
+    def __num_remaining(self, buf, offset):
+        if self.struct_sub_fmt.size == 0:
+            return 0
+        n, rest = divmod(len(buf) - offset, self.struct_sub_fmt.size)
+        if rest != 0:
+            raise struct.error("unpack requires a multiple of %d bytes" % self.struct_sub_fmt.size)
+        return n
+
+    def numpy_dtype(self):
+        """
+        NumPy structured dtype of one sub_fmt element (fields f0, f1, ...)
+        """
+        if self.__numpy_dtype is None:
+            import numpy
+            fields = []
+            for i, code in enumerate(self.sub_fmt):
+                if code not in OpaqueControlDataType.NUMPY_TYPES:
+                    raise ValueError("format %s has no NumPy equivalent" % self.sub_fmt)
+                fields.append(("f%d" % i, self.endianness + OpaqueControlDataType.NUMPY_TYPES[code]))
+            dtype = numpy.dtype(fields)
+            if dtype.itemsize != self.struct_sub_fmt.size:
+                raise ValueError("format %s is padded, it has no packed NumPy equivalent" % self.sub_fmt)
+            self.__numpy_dtype = dtype
+        return self.__numpy_dtype
+
+    def unpack_array_from(self, buf, offset=0):
+        """
+        Read the fixed part at offset and view the sub_fmt elements as a NumPy record array
+        without copying them. Returns the fixed values, the records and the offset following them
+        """
+        import numpy
+        fixed = self.struct_fmt.unpack_from(buf, offset)
+        offset += self.struct_fmt.size
+        n = self.__num_remaining(buf, offset)
+        records = numpy.frombuffer(buf, dtype=self.numpy_dtype(), count=n, offset=offset).view(numpy.recarray)
+        return fixed, records, offset + n * self.struct_sub_fmt.size
 
     def has_variable_size(self):
         return True
 
 
+class StructLayout():
+    """
+    Packs and unpacks the members of one level of a nested format. A member is a struct
+    format character (scalar), a list of members (struct) or a (length, member) tuple (array).
+    The length of an array is either a fixed count, or negative when the count is held by a
+    preceding scalar member of the same level (-1 being the member right before the array).
+    Consecutive fixed size members are merged into a single precompiled struct.
+    """
+
+    FIXED = 0
+    ARRAY = 1
+    STRUCT = 2
+
+    MAX_CACHED_REPEATS = 64
+
+    def __init__(self, members, compile):
+        self.members = members
+        self.compile = compile
+        self.steps = []
+        self.fixed_size = 0
+        self.is_fixed = all(StructLayout.member_is_fixed(member) for member in members)
+        self.__repeated_structs = {}
+        run_start = 0
+        run_fmt = ""
+        run_shapes = []
+        for i, member in enumerate(members):
+            if StructLayout.member_is_fixed(member):
+                if not run_shapes:
+                    run_start = i
+                run_fmt += StructLayout.member_format(member)
+                run_shapes.append(StructLayout.member_shape(member))
+                continue
+            if run_shapes:
+                self.__add_fixed_step(run_start, i, run_fmt, run_shapes)
+                run_fmt = ""
+                run_shapes = []
+            if isinstance(member, list):
+                self.steps.append((StructLayout.STRUCT, i, StructLayout(member, compile)))
+                continue
+            length, element = member
+            ref = None
+            if length < 0:
+                ref = i + length
+                if ref < 0 or not isinstance(members[ref], str):
+                    raise ValueError("array length %d does not refer to a preceding scalar" % length)
+            self.steps.append((StructLayout.ARRAY, i, length, ref, StructLayout([element], compile)))
+        if run_shapes:
+            self.__add_fixed_step(run_start, len(members), run_fmt, run_shapes)
+        if self.is_fixed:
+            self.struct_fmt = self.compile(StructLayout.member_format(members))
+            self.shape = StructLayout.member_shape(members[0]) if len(members) == 1 else None
+            # number of scalars of a struct of scalars, its elements can be sliced from the flat values
+            self.num_scalars = len(self.shape) if isinstance(self.shape, list) and not any(self.shape) else 0
+
+    def __add_fixed_step(self, start, end, fmt, shapes):
+        fmt_struct = self.compile(fmt)
+        if all(shape is None for shape in shapes):
+            shapes = None
+        self.steps.append((StructLayout.FIXED, start, end, fmt_struct, shapes))
+        self.fixed_size += fmt_struct.size
+
+    @staticmethod
+    def member_is_fixed(member):
+        if isinstance(member, str):
+            return True
+        if isinstance(member, list):
+            return all(StructLayout.member_is_fixed(sub_member) for sub_member in member)
+        return member[0] > 0 and StructLayout.member_is_fixed(member[1])
+
+    @staticmethod
+    def member_format(member):
+        if isinstance(member, str):
+            return member
+        if isinstance(member, list):
+            return "".join(StructLayout.member_format(sub_member) for sub_member in member)
+        return StructLayout.member_format(member[1]) * member[0]
+
+    @staticmethod
+    def member_shape(member):
+        # None for a scalar, a list of shapes for a struct and (count, shape) for an array
+        if isinstance(member, str):
+            return None
+        if isinstance(member, list):
+            return [StructLayout.member_shape(sub_member) for sub_member in member]
+        return member[0], StructLayout.member_shape(member[1])
+
+    @staticmethod
+    def flatten(shape, value, flat):
+        if shape is None:
+            flat.append(value)
+        elif isinstance(shape, list):
+            if len(value) != len(shape):
+                raise struct.error("struct requires %d members, got %d" % (len(shape), len(value)))
+            for sub_shape, sub_value in zip(shape, value):
+                StructLayout.flatten(sub_shape, sub_value, flat)
+        else:
+            if len(value) != shape[0]:
+                raise struct.error("array requires %d elements, got %d" % (shape[0], len(value)))
+            for sub_value in value:
+                StructLayout.flatten(shape[1], sub_value, flat)
+
+    @staticmethod
+    def rebuild(shape, flat_iter):
+        if shape is None:
+            return next(flat_iter)
+        if isinstance(shape, list):
+            return tuple([StructLayout.rebuild(sub_shape, flat_iter) for sub_shape in shape])
+        return [StructLayout.rebuild(shape[1], flat_iter) for i in range(shape[0])]
+
+    def repeated_struct(self, n):
+        if n not in self.__repeated_structs:
+            if len(self.__repeated_structs) >= StructLayout.MAX_CACHED_REPEATS:
+                self.__repeated_structs.clear()
+            self.__repeated_structs[n] = self.compile(StructLayout.member_format(self.members) * n)
+        return self.__repeated_structs[n]
+
+    def has_variable_size(self):
+        return not self.is_fixed
+
+    def pack_into(self, b_array, values):
+        if len(values) != len(self.members):
+            raise struct.error("format requires %d members, got %d" % (len(self.members), len(values)))
+        for step in self.steps:
+            if step[0] == StructLayout.FIXED:
+                kind, start, end, fmt_struct, shapes = step
+                if shapes is None:
+                    b_array.extend(fmt_struct.pack(*values[start:end]))
+                else:
+                    flat = []
+                    for shape, value in zip(shapes, values[start:end]):
+                        StructLayout.flatten(shape, value, flat)
+                    b_array.extend(fmt_struct.pack(*flat))
+            elif step[0] == StructLayout.STRUCT:
+                step[2].pack_into(b_array, values[step[1]])
+            else:
+                kind, index, length, ref, element = step
+                elements = values[index]
+                n = length if ref is None else values[ref]
+                if len(elements) != n:
+                    raise struct.error("array requires %d elements, got %d" % (n, len(elements)))
+                element.pack_elements_into(b_array, elements)
+
+    def pack_elements_into(self, b_array, elements):
+        if not self.is_fixed:
+            for element in elements:
+                self.pack_into(b_array, (element,))
+        elif self.shape is None:
+            b_array.extend(self.repeated_struct(len(elements)).pack(*elements))
+        elif self.num_scalars:
+            b_array.extend(self.repeated_struct(len(elements)).pack(*[value for element in elements for value in element]))
+        else:
+            flat = []
+            for element in elements:
+                StructLayout.flatten(self.shape, element, flat)
+            b_array.extend(self.repeated_struct(len(elements)).pack(*flat))
+
+    def calcsize(self, values):
+        size = self.fixed_size
+        for step in self.steps:
+            if step[0] == StructLayout.STRUCT:
+                size += step[2].calcsize(values[step[1]])
+            elif step[0] == StructLayout.ARRAY:
+                element = step[4]
+                if element.is_fixed:
+                    size += len(values[step[1]]) * element.fixed_size
+                else:
+                    size += sum(element.calcsize((value,)) for value in values[step[1]])
+        return size
+
+    def unpack_from(self, buf, offset):
+        """
+        Returns the list of member values and the offset following them
+        """
+        values = []
+        for step in self.steps:
+            if step[0] == StructLayout.FIXED:
+                fmt_struct, shapes = step[3], step[4]
+                flat = fmt_struct.unpack_from(buf, offset)
+                offset += fmt_struct.size
+                if shapes is None:
+                    values.extend(flat)
+                else:
+                    flat_iter = iter(flat)
+                    values.extend([StructLayout.rebuild(shape, flat_iter) for shape in shapes])
+            elif step[0] == StructLayout.STRUCT:
+                sub_values, offset = step[2].unpack_from(buf, offset)
+                values.append(tuple(sub_values))
+            else:
+                kind, index, length, ref, element = step
+                elements, offset = element.unpack_elements_from(buf, offset, length if ref is None else values[ref])
+                values.append(elements)
+        return values, offset
+
+    def unpack_elements_from(self, buf, offset, n):
+        if not self.is_fixed:
+            elements = []
+            for i in range(n):
+                values, offset = self.unpack_from(buf, offset)
+                elements.append(values[0])
+            return elements, offset
+        repeated = self.repeated_struct(n)
+        flat = repeated.unpack_from(buf, offset)
+        if self.shape is None:
+            elements = list(flat)
+        elif self.num_scalars:
+            elements = list(zip(*[iter(flat)] * self.num_scalars))
+        else:
+            flat_iter = iter(flat)
+            elements = [StructLayout.rebuild(self.shape, flat_iter) for i in range(n)]
+        return elements, offset + repeated.size
+
+
+class StructuredControlDataType(ControlDataType):
+    """
+    Datatype for nested struct and array formats (see StructLayout), structs are represented
+    as tuples and arrays as lists. The members are always packed without alignment.
+    As for ControlDataType the values are passed as separate arguments, a format with a
+    single struct or array member takes the struct members or array elements instead.
+    """
+
+    def __init__(self, endianness="", members=None, fmt_specifier=""):
+        super(StructuredControlDataType, self).__init__(endianness, "")
+        self.fmt_specifier = fmt_specifier
+        self.layout = StructLayout(members, self.compile)
+        self.size = self.layout.fixed_size
+
+    def compile(self, fmt):
+        return struct.Struct(self.endianness + fmt)
+
+    def __values(self, val):
+        if len(self.layout.members) == 1 and not isinstance(self.layout.members[0], str):
+            return (val,)
+        return val
+
+    def to_bytes(self, *val):
+        """
+        Transform value(s) to bytes specified by datatype format
+        """
+        b_array = bytearray()
+        self.layout.pack_into(b_array, self.__values(val))
+        return bytes(b_array)
+
+    def calcsize(self, *val):
+        return self.layout.calcsize(self.__values(val))
+
+    def read_bytes(self, buf):
+        """
+        Read value(s) from a buffer. Returns a tuple according to the datatype format
+        """
+        return self.unpack_from(buf)[0]
+
+    def unpack_from(self, buf, offset=0):
+        """
+        Read value(s) from a buffer (e.g. a memoryview) at offset without copying it.
+        Returns the value(s) and the offset following them
+        """
+        values, offset = self.layout.unpack_from(buf, offset)
+        if len(values) == 1:
+            return values[0], offset
+        return tuple(values), offset
+
+    def has_variable_size(self):
+        return self.layout.has_variable_size()
+
+
 class ControlAttribute():
 
     def __init__(self, uid=0, name="", datatype=None):
@@ -122,12 +472,53 @@ class Parameter(ControlAttribute):
         self.change_list = []
 
 
+class EventPayloadView():
+    """
+    Undecoded event payload handed to lazy subscribers. The payload is decoded with the
+    datatype of the event on the first access and the value is shared by all readers.
+    """
+
+    def __init__(self, datatype, buf, offset=0):
+        self.datatype = datatype
+        self.buf = buf
+        self.offset = offset
+        self.__value = None
+        self.__decoded = False
+
+    @property
+    def value(self):
+        if not self.__decoded:
+            self.__value = self.datatype.unpack_from(self.buf, self.offset)[0]
+            self.__decoded = True
+        return self.__value
+
+    def __getitem__(self, index):
+        return self.value[index]
+
+    def to_bytes(self):
+        """
+        Returns the raw payload without decoding it
+        """
+        return bytes(self.buf[self.offset:])
+
+
 class Event(ControlAttribute):
 
     def __init__(self, uid=0, name="", datatype=None):
         ControlAttribute.__init__(self, uid, name, datatype)
         self.event_duration = 0
         self.subscriber_callbacks = []
+        # called with an EventPayloadView instead of the decoded value
+        self.lazy_subscriber_callbacks = []
+
+    def has_subscribers(self):
+        return bool(self.subscriber_callbacks or self.lazy_subscriber_callbacks)
+
+    def add_subscriber(self, callback, lazy=False):
+        if lazy:
+            self.lazy_subscriber_callbacks.append(callback)
+        else:
+            self.subscriber_callbacks.append(callback)
 
 
 class Measurement(ControlAttribute):
@@ -1,10 +1,14 @@
 import configparser as ConfigParser
 import logging
 import abc
+import struct
 from communication_wrappers.serialdump_wrapper import SerialdumpWrapper
+from communication_wrappers.slip_wrapper import SLIPSerialWrapper
 from communication_wrappers.coap_wrapper import CoAPWrapper
+from communication_wrappers.lib_firewall import TunslipFirewall
+from communication_wrappers.lib_communication_wrapper import BaudrateRegistry
 import csv
-from wishful_module_gitar.lib_gitar import ProtocolConnector, ControlFunction, ControlDataType, OpaqueControlDataType, Parameter, Event, Measurement
+from wishful_module_gitar.lib_gitar import ProtocolConnector, ControlFunction, ControlDataType, OpaqueControlDataType, StructuredControlDataType, Parameter, Event, Measurement
 import traceback
 import sys
 import subprocess
@@ -104,6 +108,8 @@ class SensorPlatform():
         self.dt_formats_by_id = {}
         self.dt_formats_by_name = {}
         self.endianness_fmt = endianness_fmt
+        self.__codecs = None
+        self.__structured_codecs = {}
         for dt_name, dt_format in SensorPlatform.DATATYPE_NAMES_TO_FORMAT.items():
             self.dt_formats_by_id[SensorPlatform.DATATYPES.index(dt_name)] = dt_format
             self.dt_formats_by_name[dt_name] = dt_format
@@ -118,6 +124,33 @@ class SensorPlatform():
             return self.dt_formats_by_name[name]
         return None
 
+    def get_codec(self, name):
+        """
+        Returns the precompiled struct.Struct of a primitive datatype in the endianness of the platform.
+        The table is compiled once, after the platform subclass has added its own formats.
+        """
+        if self.__codecs is None:
+            codecs = {}
+            for dt_name, dt_format in self.dt_formats_by_name.items():
+                if dt_format:
+                    codecs[dt_name] = struct.Struct(self.endianness_fmt + dt_format)
+            self.__codecs = codecs
+        return self.__codecs.get(name)
+
+    def compile_format_specifier(self, fmt_specifier, endianness=""):
+        """
+        Returns the StructuredControlDataType of a nested format specifier (see parse_format_specifier),
+        every specifier is only parsed and compiled once per platform and endianness.
+        """
+        if endianness == "":
+            endianness = self.endianness_fmt
+        key = (endianness, fmt_specifier)
+        codec = self.__structured_codecs.get(key)
+        if codec is None:
+            codec = StructuredControlDataType(endianness, parse_format_specifier(fmt_specifier, self), fmt_specifier)
+            self.__structured_codecs[key] = codec
+        return codec
+
     def get_supported_datatypes(self):
         return SensorPlatform.DATATYPES
 
@@ -142,6 +175,8 @@ class SensorNode():
         self.platform = platform
         self.__connectorsIDs = {}
         self.__connectors = {}
+        # (kind, name) and (kind, uid) of every parameter, event and measurement to its (connector, attribute) entries
+        self.__attr_index = {}
 
     def add_connector(self, connector):
         if isinstance(connector, ProtocolConnector):
@@ -173,10 +208,27 @@ class SensorNode():
     def num_of_connectors(self):
             return len(self.__connectors)
 
+    def __index_attr(self, kind, connector, attr):
+        for key in ((kind, attr.name), (kind, attr.uid)):
+            self.__attr_index.setdefault(key, []).append((connector, attr))
+
+    def find_attr(self, kind, key, connector_ids=None):
+        """
+        Returns the (connector, attribute) of the parameter, event or measurement (kind) with name or uid key,
+        the first one added when several connectors have it. Only connectors in connector_ids are considered if given.
+        """
+        for connector, attr in self.__attr_index.get((kind, key), ()):
+            if connector_ids is None or connector.uid in connector_ids:
+                return connector, attr
+        return None
+
     def add_parameter(self, connector, parameter):
         con = self.get_connector(connector)
         if con is not None:
-            return con.add_parameter(parameter)
+            if con.add_parameter(parameter):
+                self.__index_attr("parameter", con, parameter)
+                return True
+            return False
 
     def get_parameter(self, connector, parameter):
         con = self.get_connector(connector)
@@ -218,7 +270,10 @@ class SensorNode():
     def add_event(self, connector, event):
         con = self.get_connector(connector)
         if con is not None:
-            return con.add_event(event)
+            if con.add_event(event):
+                self.__index_attr("event", con, event)
+                return True
+            return False
 
     def get_event(self, connector, event):
         con = self.get_connector(connector)
@@ -239,7 +294,10 @@ class SensorNode():
     def add_measurement(self, connector, measurement):
         con = self.get_connector(connector)
         if con is not None:
-            return con.add_measurement(measurement)
+            if con.add_measurement(measurement):
+                self.__index_attr("measurement", con, measurement)
+                return True
+            return False
 
     def get_measurement(self, connector, measurement):
         con = self.get_connector(connector)
@@ -264,7 +322,7 @@ class SensorNode():
 
 
     @abc.abstractmethod
-    def set_parameters(self, param_list, param_key_values):
+    def set_parameters(self, param_list, param_key_values, confirmed=True):
         pass
 
     @abc.abstractmethod
@@ -355,6 +413,7 @@ class SensorNodeFactory():
         #     platform = SensorPlatform.create_instance(platform_module, platform_class)
         #     self.__nodes[interface] = RPCNode(interface, platform, com_wrapper)
         motelist_output = subprocess.check_output([os.path.join(BIN_DIR, "motelist"), "-c"], universal_newlines=True).strip()
+        firewall = TunslipFirewall()
         if motelist_output == "No devices found.":
             # check if there are cooja devices!
             try:
@@ -362,7 +421,7 @@ class SensorNodeFactory():
                 for i, cooja_dev in enumerate(cooja_devs):
                     platform_class = "RM090"
                     platform_module = "lib_msp430"
-                    com_wrapper = CoAPWrapper(i + 1, cooja_dev, "115200", "500")  # Jan: 500 serial delay for taisc (writing to serial while in interrupt causes issues)
+                    com_wrapper = CoAPWrapper(i + 1, cooja_dev, BaudrateRegistry.get(cooja_dev), "500", firewall=firewall)  # Jan: 500 serial delay for taisc (writing to serial while in interrupt causes issues)
                     platform = SensorPlatform.create_instance(platform_module, platform_class)
                     interface = "lowpan" + str(i)
                     self.__nodes[interface] = RPCNode(interface, platform, com_wrapper)
@@ -376,7 +435,7 @@ class SensorNodeFactory():
             if "/dev/rm090" in wilab_nodes_output:
                 platform_class = "RM090"
                 platform_module = "lib_msp430"
-                com_wrapper = CoAPWrapper(1, "/dev/rm090", "115200")  # Jan: 500 serial delay for taisc (writing to serial while in interrupt causes issues)
+                com_wrapper = CoAPWrapper(1, "/dev/rm090", BaudrateRegistry.get("/dev/rm090"), firewall=firewall)  # Jan: 500 serial delay for taisc (writing to serial while in interrupt causes issues)
                 platform = SensorPlatform.create_instance(platform_module, platform_class)
                 interface = "lowpan0"
                 self.__nodes[interface] = RPCNode(interface, platform, com_wrapper)
@@ -401,18 +460,19 @@ class SensorNodeFactory():
                         self.log.info(out)
                         self.log.info("Found Zoul on %s", mote_dev)
                         gevent.sleep(2)
-                        com_wrapper = CoAPWrapper(mote_dev_id, mote_dev, "115200")
+                        com_wrapper = CoAPWrapper(mote_dev_id, mote_dev, BaudrateRegistry.get(mote_dev), firewall=firewall)
                     elif "RM090" in mote_description:
                         # defince is a RM090
                         platform_class = "RM090"
                         platform_module = "lib_msp430"
                         self.log.info("Found RM090 on %s", mote_dev)
-                        com_wrapper = CoAPWrapper(mote_dev_id, mote_dev, "115200", "500")
+                        com_wrapper = CoAPWrapper(mote_dev_id, mote_dev, BaudrateRegistry.get(mote_dev), "500", firewall=firewall)
                     else:
                         self.log.info("skipping unknown node type")
                         continue                        
                     platform = SensorPlatform.create_instance(platform_module, platform_class)
                     self.__nodes[interface] = RPCNode("lowpan0", platform, com_wrapper)
+        firewall.apply()
          
 
     def create_nodes(self, config_file, supported_interfaces):
@@ -434,11 +494,22 @@ class SensorNodeFactory():
 
                 # Create a com_wrapper instance
                 com_method = config.get(interface, 'CommunicationMethod')
+                # a fixed rate, or "auto" to negotiate the highest rate the node supports,
+                # tunslip and serialdump have no handshake and stay at the remembered rate
+                baudrate = config.get(interface, 'SerialBaudrate', fallback="auto" if com_method == 'SLIP' else str(BaudrateRegistry.get(serial_dev)))
+                if baudrate == "auto" and com_method != 'SLIP':
+                    self.log.info('No link speed negotiation for %s on %s, using %d baud', com_method, serial_dev, BaudrateRegistry.get(serial_dev))
+                elif baudrate != "auto":
+                    BaudrateRegistry.set(serial_dev, baudrate)
                 com_wrapper = None
                 if com_method == 'ContikiSerialdump':
                     com_wrapper = SerialdumpWrapper(serial_dev, interface)
+                elif com_method == 'SLIP':
+                    com_wrapper = SLIPSerialWrapper(serial_dev, interface)
+                    if baudrate == "auto":
+                        com_wrapper.negotiate_baudrate()
                 elif com_method == 'CoAP':
-                    com_wrapper = CoAPWrapper(ip_addr, node_id, serial_dev)
+                    com_wrapper = CoAPWrapper(node_id, serial_dev, BaudrateRegistry.get(serial_dev))
                 else:
                     self.log.fatal('invalid CommunicationMethod')
 
@@ -495,6 +566,8 @@ class SensorNodeFactory():
                     if attribute_def["sub_format"] == "":
                         if attribute_def["format"] in node.platform.get_supported_datatypes():
                             ctrl_attr.set_datatype(ControlDataType(attribute_def["endianness"], node.platform.get_data_type_format_by_name(attribute_def["format"])))
+                        elif is_nested_format_specifier(attribute_def["format"]):
+                            ctrl_attr.set_datatype(node.platform.compile_format_specifier(attribute_def["format"], attribute_def["endianness"]))
                         else:
                             # ctrl_attr.set_datatype(ControlDataType(attribute_def["endianness"], attribute_def["format"]))
                             ctrl_attr.set_datatype(ControlDataType(attribute_def["endianness"], self.__parse_struct_attribute(node.platform, attribute_def["format"])))
@@ -578,139 +651,53 @@ class SensorNodeFactory():
         return self.__nodes[interface_name]
 
 
-def parse_attribute_format_specifier(fmt_specifier, platform):
-    if ";" not in fmt_specifier:
-        # simple format (non-struct type or directly in struct format)
-        if fmt_specifier not in SensorPlatform.DATATYPES:
-            # assume struct format
-            return fmt_specifier
-        else:
-            return platform.get_data_type_format_by_name(fmt_specifier)
-    else:
-        dt_strct_fmt = ""
-        # cannot be a struct format (e.g. HHB), but a format specifier for structs (UINT16;UINT16;UINT8) so parse it as such
-        if '(' not in fmt_specifier:
-            # the format does not contain substructs
-            for subformat in fmt_specifier.split(";"):
-                dt_strct_fmt = dt_strct_fmt + platform.get_data_type_format_by_name(subformat)
-            return dt_strct_fmt
-        else:
-            find_substruct(fmt_specifier, platform)
-
-
-def find_substruct(fmt_specifier, platform):
-    ind = fmt_specifier.find('(')
-    struct_fmt = ""
-    if '(' in fmt_specifier[ind:len(fmt_specifier)]:
-        struct_fmt = struct_fmt + find_substruct(fmt_specifier[ind:len(fmt_specifier)], platform)
-    ind2 = fmt_specifier.find(')')
-    for el in fmt_specifier[ind, ind2].split(";"):
-        struct_fmt = struct_fmt + platform.get_data_type_format_by_name(el)
-
-def split_format_specifier(fmt_specifier, parent_index):
-    closing_brackets = {'{': '}', '[': ']'}
-    if fmt_specifier != "":
-        sub_index = "1"
-        sub_hash = {}
-        begin_pos = 0
-        split_pos = 0
-        while(split_pos != -1):
-            split_pos = fmt_specifier.find(";")
-            prefix = fmt_specifier[begin_pos:split_pos]
-            suffix = fmt_specifier[split_pos:]
-            if prefix[0] == '{' or prefix[0] == '[':
-                pos = find_matching_bracket(suffix, prefix[0], closing_brackets[prefix[0]])
-
-            else:
-                sub_hash[parent_index + sub_index] = sub_str
-                begin_pos = split_pos + 1
-                sub_index = str(int(sub_index) + 1)
-        return sub_hash
-
-
-from construct import *
-
-le_platform_cnstrct_map = ["uS", "sS", "uI", "sI", "uL", "sL", "uF", "sF", "uD", "sD"]
-le_base_cnstrct_map = {"u1": Int8ul, "u2": Int16ul, "u4": Int32ul, "u8": Int64ul, "i1": Int8sl, "i2": Int16sl, "i4": Int32sl, "i8": Int64sl, "f4": Float32l, "f8": Float64l}
-be_construct_map = {}
-
-def create_construct(fmt_map):
-    lst_ret = []
-    print("calling construct on {}".format(fmt_map))
-    for key in sorted(fmt_map.keys()):
-        print(key)
-        if type(fmt_map[key]) == dict:
-            c = create_construct(fmt_map[key])
-            if fmt_map[key]['type'] == "array":
-                array_len = fmt_map[key]['len']
-                print("Creating Array {} len {}".format(c, array_len))
-                if int(array_len) > 0:
-                    lst_ret.append(key / Array(int(array_len), Struct(*c)))
-                else:
-                    # relative to previous element
-                    ind_key = str(int(key) + int(array_len))
-                    print(ind_key)
-                    lst_ret.append(key / Array(lambda ctx: ctx[ind_key], Struct(*c)))
-                    print("bla")
-            elif fmt_map[key]['type'] == "struct":
-                print("Creating struct {}".format(c))
-                lst_ret.append(key / Struct(*c))
-        elif key != 'type' and key != 'len':
-            lst_ret.append(key / construct_map[fmt_map[key]])
-    print(lst_ret)
-    return tuple(lst_ret)
-
-
-def parse_format_specifier(fmt_specifier, fmt_map, parent_index):
-    brackets_open = "{["
-    brackets_close = "}]"
-    sub_index = "1"
+def split_format_specifier(fmt_specifier):
+    """
+    Split a format specifier on the ';' separators that are not enclosed in brackets
+    """
+    members = []
+    depth = 0
     begin_pos = 0
-    end_pos = -1
-    while begin_pos < len(fmt_specifier):
-        print(begin_pos)
-        print(fmt_specifier[begin_pos:])
-        if fmt_specifier[begin_pos] == "":
-            return
-        elif fmt_specifier[begin_pos] in brackets_open:
-            ind = brackets_open.index(fmt_specifier[begin_pos])
-            begin_pos = begin_pos + 1
-            end_pos = begin_pos + find_matching_bracket(fmt_specifier[begin_pos:], brackets_open[ind], brackets_close[ind])
-            print("{} {}".format(begin_pos, end_pos))
-            fmt_map[parent_index + sub_index] = {}
-            if brackets_open[ind] == "[":
-                fmt_map[parent_index + sub_index]["type"] = "array"
-                tmp_pos = fmt_specifier[begin_pos:end_pos].find(";")
-                fmt_map[parent_index + sub_index]["len"] = fmt_specifier[begin_pos:begin_pos + tmp_pos]
-                begin_pos = begin_pos + tmp_pos + 1
-            elif brackets_open[ind] == "{":
-                fmt_map[parent_index + sub_index]["type"] = "struct"
-            print("substruct: " + parent_index + "." + sub_index + " " + fmt_specifier[begin_pos:end_pos])
-            parse_format_specifier(fmt_specifier[begin_pos:end_pos], fmt_map[parent_index + sub_index], parent_index + sub_index)
-            print(sub_index)
-            sub_index = str(int(sub_index) + 1)
-        else:
-            end_pos = begin_pos + fmt_specifier[begin_pos:].find(";")
-            print("{} {}".format(begin_pos, end_pos))
-            if end_pos == begin_pos - 1:
-                print(parent_index + "." + sub_index + ": " + fmt_specifier[begin_pos:])
-                fmt_map[parent_index + sub_index] = fmt_specifier[begin_pos:]
-                return
-            elif fmt_specifier[begin_pos] != ';':
-                print(parent_index + "." + sub_index + ": " + fmt_specifier[begin_pos:end_pos])
-                fmt_map[parent_index + sub_index] = fmt_specifier[begin_pos:end_pos]
-                sub_index = str(int(sub_index) + 1)
-        begin_pos = end_pos + 1
-
-
-def find_matching_bracket(fmt_specifier, bracket_open, bracket_close):
-    print("{} {} {}".format(fmt_specifier, bracket_open, bracket_close))
-    bracket_open_stack = []
     for i, c in enumerate(fmt_specifier):
-        if c == bracket_open:
-            bracket_open_stack.append(i)
-        elif c == bracket_close:
-            if not bracket_open_stack:
-                return i
-            bracket_open_stack.pop()
-    return -1
+        if c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth < 0:
+                raise ValueError("unbalanced brackets in format %s" % fmt_specifier)
+        elif c == ";" and depth == 0:
+            members.append(fmt_specifier[begin_pos:i].strip())
+            begin_pos = i + 1
+    if depth != 0:
+        raise ValueError("unbalanced brackets in format %s" % fmt_specifier)
+    members.append(fmt_specifier[begin_pos:].strip())
+    return members
+
+
+def parse_format_specifier(fmt_specifier, platform):
+    """
+    Parse a format specifier into StructLayout members. Members are datatype names separated by ';',
+    {...} is a struct and [len;...] an array of len elements of the enclosed members. A negative len
+    takes the number of elements from a preceding member, e.g. "UINT8;[-1;{UINT16;INT8}]".
+    """
+    members = []
+    for member in split_format_specifier(fmt_specifier):
+        if member.startswith("{") and member.endswith("}"):
+            members.append(parse_format_specifier(member[1:-1], platform))
+        elif member.startswith("[") and member.endswith("]"):
+            array_len, sep, element_specifier = member[1:-1].partition(";")
+            array_len = int(array_len)
+            if array_len == 0 or element_specifier == "":
+                raise ValueError("invalid array format %s" % member)
+            element = parse_format_specifier(element_specifier, platform)
+            members.append((array_len, element[0] if len(element) == 1 else element))
+        else:
+            fmt = platform.get_data_type_format_by_name(member)
+            if not fmt:
+                raise ValueError("invalid datatype %s in format %s" % (member, fmt_specifier))
+            members.append(fmt)
+    return members
+
+
+def is_nested_format_specifier(fmt_specifier):
+    return "{" in fmt_specifier or "[" in fmt_specifier
@@ -1,8 +1,11 @@
 import errno
 import struct
-import collections
-from wishful_module_gitar.lib_gitar import ControlDataType, Parameter, Event
+import collections.abc
+import functools
+import threading
+from wishful_module_gitar.lib_gitar import Parameter, Event, EventPayloadView
 from wishful_module_gitar.lib_sensor import SensorNode
+from communication_wrappers.lib_event_queue import EventQueue, OverflowPolicy
 
 
 class RPCFuncHdr():
@@ -95,27 +98,203 @@ def read_RPCRetHdr(message):
 #             return False
 
 
+class MeasurementReport():
+    """
+    Collects measurement notifications pushed by the node into periodic reports,
+    using the same report_callback contract as the polling collection.
+    """
+
+    def __init__(self, node, measurement_list, samples_per_report, num_iterations, report_callback):
+        self.node = node
+        self.measurement_list = measurement_list
+        self.samples_per_report = samples_per_report
+        self.num_iterations = num_iterations
+        self.report_callback = report_callback
+        self.observation = None
+        self.__lock = threading.Lock()
+        self.__iteration = 0
+        self.__num_samples = 0
+        self.__registered = False
+        self.__report = self.__new_report()
+
+    def __new_report(self):
+        report = {}
+        for measurement in self.measurement_list:
+            report[measurement.name] = []
+        return report
+
+    def add_notification(self, payload):
+        """
+        Called from the event workers of the node, never from the transport
+        """
+        with self.__lock:
+            if self.__iteration >= self.num_iterations:
+                return
+            # the answer to the registration is not a sample, the polling collection also waits collect_period first
+            if not self.__registered:
+                self.__registered = True
+                return
+            values = self.node.create_attr_key_value_from_bytearray("measurement", len(self.measurement_list), payload)
+            for key in values.keys():
+                if key in self.__report:
+                    self.__report[key].append(values[key])
+            self.__num_samples += 1
+            if self.__num_samples < self.samples_per_report:
+                return
+            report = self.__report
+            self.__report = self.__new_report()
+            self.__num_samples = 0
+            self.__iteration += 1
+            if self.__iteration >= self.num_iterations and self.observation is not None:
+                self.node.com_wrapper.cancel_observation(self.observation)
+        self.report_callback(self.node.interface, report)
+
+    def set_observation(self, observation):
+        """
+        Called once observe returned, the report may already have finished by then
+        """
+        with self.__lock:
+            self.observation = observation
+            if self.__iteration >= self.num_iterations and observation is not None:
+                self.node.com_wrapper.cancel_observation(observation)
+
+
 class RPCNode(SensorNode):
 
-    def __init__(self, interface, platform, com_wrapper):
+    # used when the com_wrapper does not announce its mtu
+    DEFAULT_MTU = 64
+    # args_len in the RPC function header is a single byte
+    MAX_ARGS_LEN = 255
+
+    def __init__(self, interface, platform, com_wrapper, event_queue_size=256, event_overflow_policy=OverflowPolicy.DROP_OLDEST, num_event_workers=1):
         SensorNode.__init__(self, interface, platform)
         self.com_wrapper = com_wrapper
-        self.com_wrapper.add_event_callback(self.dispatch_event)
+        self.mtu = getattr(com_wrapper, "mtu", RPCNode.DEFAULT_MTU)
+        # batched functions the firmware turned out (not) to implement
+        self.__supported_functions = set()
+        self.__unsupported_functions = set()
+        # events are dispatched by worker threads so slow subscribers do not stall the transport
+        self.event_queue = EventQueue(self.__dispatch, event_queue_size, event_overflow_policy, num_event_workers, self.__read_event_uid, interface)
+        self.com_wrapper.add_event_callback(self.__queue_event)
+
+    def __queue_event(self, event_msg, block=True):
+        # events nobody subscribed to are discarded here, they do not take up queue slots
+        event_uid = self.__read_event_uid(event_msg)
+        event = self.get_attr_by_key("event", event_uid) if event_uid is not None else None
+        if event is None or not event.has_subscribers():
+            self.log.debug("RPC node %s: dropping event %s without subscribers", self.interface, event_uid)
+            self.event_queue.discard(event_msg)
+            return False
+        return self.event_queue.put(event_msg, block)
+
+    def __read_event_uid(self, event_msg):
+        if callable(event_msg) or len(event_msg) < 2:
+            return None
+        return self.platform.get_codec('UINT16').unpack_from(event_msg)[0]
+
+    def __dispatch(self, item):
+        # the event workers also run the tasks queued by queue_task
+        if callable(item):
+            item()
+        else:
+            self.dispatch_event(item)
+
+    def queue_task(self, task, block=True):
+        """
+        Run task on the event workers of the node, in order with the events.
+        Same return values as EventQueue.put
+        """
+        return self.event_queue.put(task, block)
+
+    def get_event_stats(self):
+        """
+        Returns the received, dispatched, failed, dropped and discarded event counters of the node, also per event uid
+        """
+        return self.event_queue.get_stats()
+
+    def send_requests(self, request_messages):
+        """
+        Send a list of request messages and return the responses in the same order.
+        Requests are pipelined when the com_wrapper supports send_async.
+        """
+        if hasattr(self.com_wrapper, "send_async"):
+            futures = [self.com_wrapper.send_async(request_message) for request_message in request_messages]
+            return [future.result() for future in futures]
+        return [self.com_wrapper.send(request_message) for request_message in request_messages]
+
+    def create_batches(self, attr_list, request_size_func, response_size_func):
+        """
+        Split attr_list in batches of which both the request and the response fit in the mtu.
+        The size functions return the number of bytes an attribute adds, or None when it is
+        not known in advance, such an attribute is put in a batch of its own.
+        """
+        max_args_len = min(self.mtu - RPCFuncHdr.fmt.size, RPCNode.MAX_ARGS_LEN)
+        max_ret_len = self.mtu - RPCRetHdr.fmt.size
+        batches = []
+        batch = []
+        args_len = 0
+        ret_len = 0
+        for attr in attr_list:
+            attr_args_len = request_size_func(attr)
+            attr_ret_len = response_size_func(attr)
+            if attr_ret_len is None:
+                attr_ret_len = max_ret_len
+            if batch and (args_len + attr_args_len > max_args_len or ret_len + attr_ret_len > max_ret_len):
+                batches.append(batch)
+                batch = []
+                args_len = 0
+                ret_len = 0
+            batch.append(attr)
+            args_len += attr_args_len
+            ret_len += attr_ret_len
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def create_batched_requests(self, function_name, batches, attr_args=None):
+        """
+        Create one request message per batch for a batched generic_connector function,
+        returns None when the firmware does not provide the function.
+        """
+        generic_connector = self.get_connector("generic_connector")
+        f = generic_connector.get_function(function_name)
+        if f is None or function_name in self.__unsupported_functions:
+            return None
+        request_messages = []
+        for batch in batches:
+            b_array = self.create_bytearray_from_attr_list(batch, attr_args)
+            request_message = bytearray()
+            request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), len(b_array)).to_bytes())
+            request_message.extend(b_array)
+            request_messages.append(request_message)
+        return request_messages
+
+    def call_batched(self, function_name, batches, attr_args=None):
+        """
+        Call a batched generic_connector function once per batch, the requests are pipelined.
+        Returns a list with the return code and the response arguments of every batch, or None
+        when the firmware does not provide the function.
+        """
+        request_messages = self.create_batched_requests(function_name, batches, attr_args)
+        if request_messages is None:
+            return None
+        results = []
+        for response_message in self.send_requests(request_messages):
+            ret_hdr = read_RPCRetHdr(response_message)
+            if ret_hdr.ret_code == errno.ENOSYS:
+                self.log.info("Node %s does not implement %s, falling back to single attribute calls", self.interface, function_name)
+                self.__unsupported_functions.add(function_name)
+                return None
+            results.append((ret_hdr.ret_code, memoryview(response_message)[len(ret_hdr):]))
+        self.__supported_functions.add(function_name)
+        return results
 
     def get_attr_by_key(self, attr_type, attr_key):
-        attr = None
-        for connector_id in self.get_connector_ids():
-            if attr_type == 'parameter':
-                attr = self.get_parameter(connector_id, attr_key)
-            elif attr_type == 'event':
-                attr = self.get_event(connector_id, attr_key)
-            elif attr_type == 'measurement':
-                attr = self.get_measurement(connector_id, attr_key)
-            if attr is not None:
-                return attr
-        if attr is None:
-            self.log.info("Attr %s not found", attr_key)
-        return None
+        entry = self.find_attr(attr_type, attr_key)
+        if entry is None:
+            self.log.debug("Attr %s not found", attr_key)
+            return None
+        return entry[1]
 
     # def create_attribute_list_from_keys(self, attr_key_list, attr_type):
     #     attr_list = []
@@ -128,197 +307,274 @@ class RPCNode(SensorNode):
     def create_bytearray_from_attr_list(self, attr_list, attr_args=None):
         b_array = bytearray()
         for attr in attr_list:
-            b_array.extend(ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).to_bytes(attr.uid))
+            b_array.extend(self.platform.get_codec('UINT16').pack(attr.uid))
             if type(attr) == Parameter and attr_args is not None and type(attr_args) == dict:
-                # b_array.extend(ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT8')).to_bytes(attr.datatype.size))
-                b_array.extend(attr.datatype.to_bytes(attr_args[attr.name]))
+                # b_array.extend(self.platform.get_codec('UINT8').pack(attr.datatype.size))
+                b_array.extend(self.value_to_bytes(attr, attr_args[attr.name]))
             elif type(attr) == Event and attr_args is not None:
-                b_array.extend(ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT32')).to_bytes(attr_args))
+                b_array.extend(self.platform.get_codec('UINT32').pack(attr_args))
         return b_array
 
+    def value_as_tuple(self, value):
+        if isinstance(value, collections.abc.Sequence) and not isinstance(value, (str, bytes, bytearray)):
+            return tuple(value)
+        return (value,)
+
+    def value_to_bytes(self, attr, value):
+        return attr.datatype.to_bytes(*self.value_as_tuple(value))
+
+    def value_size(self, attr, value):
+        if attr.datatype.has_variable_size():
+            return attr.datatype.calcsize(*self.value_as_tuple(value))
+        return attr.datatype.size
+
     def create_attr_key_value_from_bytearray(self, attr_type, num_attr, b_array):
         line_ptr = 0
         attr_key_value = {}
+        dt_uid = self.platform.get_codec('UINT16')
+        # decode in place, slicing would copy the rest of the buffer for every attribute
+        buf = memoryview(b_array)
         for i in range(0, num_attr):
-            attr_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(b_array[line_ptr:])
-            line_ptr += 2
+            if line_ptr + dt_uid.size > len(buf):
+                break
+            attr_uid = dt_uid.unpack_from(buf, line_ptr)[0]
+            line_ptr += dt_uid.size
             attr = self.get_attr_by_key(attr_type, attr_uid)
-            if attr is not None:
-                attr_key_value[attr.name] = attr.datatype.read_bytes(b_array[line_ptr:])
-                if attr.datatype.has_variable_size():
-                    line_ptr += attr.datatype.calcsize(*attr_key_value[attr.name])
-                else:
-                    line_ptr += attr.datatype.size
+            if attr is None:
+                # the size of the value is unknown, the rest of the buffer cannot be decoded
+                break
+            attr_key_value[attr.name], line_ptr = attr.datatype.unpack_from(buf, line_ptr)
         return attr_key_value
 
     def create_attr_key_error_from_bytearray(self, attr_type, num_attr, b_array):
         line_ptr = 0
         attr_key_error = {}
+        dt_uid = self.platform.get_codec('UINT16')
+        dt_err = self.platform.get_codec('INT8')
         for i in range(0, num_attr):
-            attr_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(b_array[line_ptr:])
-            line_ptr += 2
+            if line_ptr + dt_uid.size + dt_err.size > len(b_array):
+                break
+            attr_uid = dt_uid.unpack_from(b_array, line_ptr)[0]
+            line_ptr += dt_uid.size
             attr = self.get_attr_by_key(attr_type, attr_uid)
             if attr is not None:
-                attr_key_error[attr.name] = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8')).read_bytes(b_array[line_ptr:])
-                line_ptr += 1
+                attr_key_error[attr.name] = dt_err.unpack_from(b_array, line_ptr)[0]
+            line_ptr += dt_err.size
         return attr_key_error
 
-    def set_parameters2(self, parameter_list, param_key_values):
-        generic_connector = self.get_connector("generic_connector")
-        f = generic_connector.get_function('set_parameters')
-        b_array = self.create_bytearray_from_attr_list(parameter_list, param_key_values)
-        request_message = bytearray()
-        request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), len(b_array)).to_bytes())
-        request_message.extend(b_array)
-        response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message)
-        if ret_hdr.ret_code == 0:
-            return self.create_attr_key_error_from_bytearray("parameter", len(parameter_list), response_message[len(ret_hdr):])
-        return ret_hdr.ret_code
+    def set_parameters(self, parameter_list, param_key_values, confirmed=True):
+        """
+        Write the parameters, returns a dict with the error code of every parameter.
+        All uid/value pairs are sent in as few set_parameters RPCs as the mtu allows, or with one
+        set_parameter RPC per parameter when the firmware lacks the batched function.
+        With confirmed=False the writes are sent fire-and-forget when the com_wrapper supports it
+        (e.g. CoAP NON requests), the error code of every parameter is then None. An unconfirmed
+        write cannot detect a missing batched function, so the writes are only batched once a
+        confirmed set_parameters call succeeded.
+        """
+        dt_uid = self.platform.get_codec('UINT16')
+        dt_err = self.platform.get_codec('INT8')
+        batches = self.create_batches(parameter_list, lambda param: dt_uid.size + self.value_size(param, param_key_values[param.name]),
+                                      lambda param: dt_uid.size + dt_err.size)
+        if not confirmed and hasattr(self.com_wrapper, "send_nowait"):
+            request_messages = None
+            if 'set_parameters' in self.__supported_functions:
+                request_messages = self.create_batched_requests('set_parameters', batches, param_key_values)
+            if request_messages is None:
+                request_messages = self.create_set_parameter_requests(parameter_list, param_key_values)
+            for request_message in request_messages:
+                self.com_wrapper.send_nowait(request_message)
+            return {param.name: None for param in parameter_list}
+        results = self.call_batched('set_parameters', batches, param_key_values)
+        if results is None:
+            return self.set_parameters_single(parameter_list, param_key_values)
+        resp_key_values = {}
+        for batch, (ret_code, b_array) in zip(batches, results):
+            if ret_code == 0:
+                resp_key_values.update(self.create_attr_key_error_from_bytearray("parameter", len(batch), b_array))
+                for param in batch:
+                    if param.name not in resp_key_values:
+                        resp_key_values[param.name] = errno.EPROTO
+            else:
+                for param in batch:
+                    resp_key_values[param.name] = ret_code
+        return resp_key_values
 
-    def set_parameters(self, parameter_list, param_key_values):
+    def create_set_parameter_requests(self, parameter_list, param_key_values):
         generic_connector = self.get_connector("generic_connector")
         f = generic_connector.get_function('set_parameter')
-        
-        print("<<< RPC Node: set_parameters >>>", parameter_list, param_key_values)
-        resp_key_values = {}
+        dt_uid = self.platform.get_codec('UINT16')
+        request_messages = []
         for param in parameter_list:
             request_message = bytearray()
-            dt_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
-            if param.datatype.has_variable_size():
-                request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size + param.datatype.calcsize(*param_key_values[param.name])).to_bytes())
-            else:
-                request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size + param.datatype.size).to_bytes())
-            request_message.extend(dt_uid.to_bytes(param.uid))
-            # request_message.extend(ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT8')).to_bytes(param.datatype.size))
-            if isinstance(param_key_values[param.name], collections.Sequence):
-                request_message.extend(param.datatype.to_bytes(*param_key_values[param.name]))
-            else:
-                request_message.extend(param.datatype.to_bytes(param_key_values[param.name]))
-            response_message = self.com_wrapper.send(request_message)
+            request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size + self.value_size(param, param_key_values[param.name])).to_bytes())
+            request_message.extend(dt_uid.pack(param.uid))
+            request_message.extend(self.value_to_bytes(param, param_key_values[param.name]))
+            request_messages.append(request_message)
+        return request_messages
+
+    def set_parameters_single(self, parameter_list, param_key_values):
+        resp_key_values = {}
+        request_messages = self.create_set_parameter_requests(parameter_list, param_key_values)
+        for param, response_message in zip(parameter_list, self.send_requests(request_messages)):
             line_ptr = 0
-            ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+            ret_hdr = read_RPCRetHdr(response_message)
             line_ptr += len(ret_hdr)
             if ret_hdr.ret_code == 0:
-                # p_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(response_message[line_ptr:])
-                # line_ptr += 2
-                resp_key_values[param.name] = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8')).read_bytes(response_message[line_ptr:])
+                resp_key_values[param.name] = self.platform.get_codec('INT8').unpack_from(response_message, line_ptr)[0]
                 line_ptr += 1
             else:
                 resp_key_values[param.name] = ret_hdr.ret_code
-                
-        print("<<< RPC Node: set_parameters >>> !", resp_key_values)
         return resp_key_values
 
-    def get_parameters2(self, parameter_list):
-        generic_connector = self.get_connector("generic_connector")
-        f = generic_connector.get_function('get_parameters')
-        b_array = self.create_bytearray_from_attr_list(parameter_list)
-        request_message = bytearray()
-        request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), len(b_array)).to_bytes())
-        request_message.extend(b_array)
-        response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message)
-        if ret_hdr.ret_code == 0:
-            return self.create_attr_key_value_from_bytearray("parameter", len(parameter_list), response_message[len(ret_hdr):])
-        return ret_hdr.ret_code
-
     def get_parameters(self, parameter_list):
+        """
+        Read the parameters with as few get_parameters RPCs as the mtu allows,
+        or with one get_parameter RPC per parameter when the firmware lacks the batched function.
+        """
+        dt_uid = self.platform.get_codec('UINT16')
+        batches = self.create_batches(parameter_list, lambda param: dt_uid.size,
+                                      lambda param: None if param.datatype.has_variable_size() else dt_uid.size + param.datatype.size)
+        results = self.call_batched('get_parameters', batches)
+        if results is None:
+            return self.get_parameters_single(parameter_list)
+        resp_key_values = {}
+        for batch, (ret_code, b_array) in zip(batches, results):
+            if ret_code == 0:
+                resp_key_values.update(self.create_attr_key_value_from_bytearray("parameter", len(batch), b_array))
+            else:
+                self.log.info("Node %s get_parameters failed: %s", self.interface, printRetCode(ret_code))
+        return resp_key_values
+
+    def get_parameters_single(self, parameter_list):
         generic_connector = self.get_connector("generic_connector")
         f = generic_connector.get_function('get_parameter')
         resp_key_values = {}
+        request_messages = []
         for param in parameter_list:
             request_message = bytearray()
-            dt_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
+            dt_uid = self.platform.get_codec('UINT16')
             request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size).to_bytes())
-            request_message.extend(dt_uid.to_bytes(param.uid))
-            response_message = self.com_wrapper.send(request_message)
+            request_message.extend(dt_uid.pack(param.uid))
+            request_messages.append(request_message)
+        for param, response_message in zip(parameter_list, self.send_requests(request_messages)):
             line_ptr = 0
-            ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+            ret_hdr = read_RPCRetHdr(response_message)
             line_ptr += len(ret_hdr)
             if ret_hdr.ret_code == 0:
-                # p_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(response_message[line_ptr:])
+                # p_uid = self.platform.get_codec('UINT16').unpack_from(response_message, line_ptr)[0]
                 # line_ptr += 2
-                resp_key_values[param.name] = param.datatype.read_bytes(response_message[line_ptr:])
-                if param.datatype.has_variable_size():
-                    line_ptr += param.datatype.calcsize(*resp_key_values[param.name])
-                else:
-                    line_ptr += param.datatype.size
+                resp_key_values[param.name], line_ptr = param.datatype.unpack_from(memoryview(response_message), line_ptr)
         return resp_key_values
 
-    def read_measurements2(self, measurement_list):
-        generic_connector = self.get_connector("generic_connector")
-        f = generic_connector.get_function('read_measurements')
-        b_array = self.create_bytearray_from_attr_list(measurement_list)
-        request_message = bytearray()
-        request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), len(b_array)).to_bytes())
-        request_message.extend(b_array)
-        response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message)
-        if ret_hdr.ret_code == 0:
-            return self.create_attr_key_value_from_bytearray("measurement", len(measurement_list), response_message[len(ret_hdr):])
-        return ret_hdr.ret_code
-
     def read_measurements(self, measurement_list):
+        """
+        Read the measurements with as few read_measurements RPCs as the mtu allows,
+        or with one read_measurement RPC per measurement when the firmware lacks the batched function.
+        """
+        dt_uid = self.platform.get_codec('UINT16')
+        batches = self.create_batches(measurement_list, lambda measurement: dt_uid.size,
+                                      lambda measurement: None if measurement.datatype.has_variable_size() else dt_uid.size + measurement.datatype.size)
+        results = self.call_batched('read_measurements', batches)
+        if results is None:
+            return self.read_measurements_single(measurement_list)
+        resp_key_values = {}
+        for batch, (ret_code, b_array) in zip(batches, results):
+            if ret_code == 0:
+                resp_key_values.update(self.create_attr_key_value_from_bytearray("measurement", len(batch), b_array))
+            else:
+                self.log.info("Node %s read_measurements failed: %s", self.interface, printRetCode(ret_code))
+        return resp_key_values
+
+    def read_measurements_single(self, measurement_list):
         generic_connector = self.get_connector("generic_connector")
         f = generic_connector.get_function('read_measurement')
         resp_key_values = {}
+        request_messages = []
         for measurement in measurement_list:
             request_message = bytearray()
-            dt_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
+            dt_uid = self.platform.get_codec('UINT16')
             request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size).to_bytes())
-            request_message.extend(dt_uid.to_bytes(measurement.uid))
-            response_message = self.com_wrapper.send(request_message)
+            request_message.extend(dt_uid.pack(measurement.uid))
+            request_messages.append(request_message)
+        for measurement, response_message in zip(measurement_list, self.send_requests(request_messages)):
             line_ptr = 0
-            ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+            ret_hdr = read_RPCRetHdr(response_message)
             line_ptr += len(ret_hdr)
             if ret_hdr.ret_code == 0:
-                # p_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(response_message[line_ptr:])
+                # p_uid = self.platform.get_codec('UINT16').unpack_from(response_message, line_ptr)[0]
                 # line_ptr += 2
-                resp_key_values[measurement.name] = measurement.datatype.read_bytes(response_message[line_ptr:])
-                if measurement.datatype.has_variable_size():
-                    line_ptr += measurement.datatype.calcsize(*resp_key_values[measurement.name])
-                else:
-                    line_ptr += measurement.datatype.size
+                resp_key_values[measurement.name], line_ptr = measurement.datatype.unpack_from(memoryview(response_message), line_ptr)
         return resp_key_values
 
-    def subscribe_events2(self, event_list, event_callback, event_duration):
-        generic_connector = self.get_connector("generic_connector")
-        f = generic_connector.get_function('subscribe_events')
-        b_array = self.create_bytearray_from_attr_list(event_list, event_duration)
-        request_message = bytearray()
-        request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), len(b_array)).to_bytes())
-        request_message.extend(b_array)
-        response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message)
-        if ret_hdr.ret_code == 0:
-            event_key_error = self.create_attr_key_error_from_bytearray("parameter", len(event_list), response_message[len(ret_hdr):])
-            for key in event_key_error:
-                event_list[key].subscriber_callbacks.append(event_callback)
-            return event_key_error
-        return ret_hdr.ret_code
+    def observe_measurements(self, measurement_list, collect_period, report_period, num_iterations, report_callback):
+        """
+        Let the node push the measurements every collect_period seconds instead of polling them.
+        Returns False when the com_wrapper or the node does not support observing measurements.
+        """
+        if not hasattr(self.com_wrapper, "observe"):
+            return False
+        # a report holds at least one sample, also when report_period is shorter than collect_period
+        samples_per_report = max(1, int(report_period / collect_period))
+        report = MeasurementReport(self, measurement_list, samples_per_report, int(num_iterations), report_callback)
+        query = ["interval=" + str(int(collect_period * 1000))]
+        for measurement in measurement_list:
+            query.append("uid=" + str(measurement.uid))
+        # notifications arrive on the transport, the report (and report_callback) is processed by the event workers
+        report.set_observation(self.com_wrapper.observe("wishful_measurements", query,
+                                                        lambda payload, block=True: self.queue_task(functools.partial(report.add_notification, payload), block)))
+        return report.observation is not None
+
+    def subscribe_events(self, event_list, event_callback, event_duration, lazy=False):
+        """
+        Subscribe event_callback to the events with as few subscribe_events RPCs as the mtu allows,
+        or with one subscribe_event RPC per event when the firmware lacks the batched function.
+        With lazy set the callback gets an EventPayloadView which is only decoded when read.
+        Returns a dict with the error code of every event.
+        """
+        dt_uid = self.platform.get_codec('UINT16')
+        dt_duration = self.platform.get_codec('UINT32')
+        dt_err = self.platform.get_codec('INT8')
+        batches = self.create_batches(event_list, lambda event: dt_uid.size + dt_duration.size, lambda event: dt_uid.size + dt_err.size)
+        results = self.call_batched('subscribe_events', batches, event_duration)
+        if results is None:
+            return self.subscribe_events_single(event_list, event_callback, event_duration, lazy)
+        resp_key_values = {}
+        for batch, (ret_code, b_array) in zip(batches, results):
+            if ret_code != 0:
+                self.log.info("Node %s subscribe_events failed: %s", self.interface, printRetCode(ret_code))
+                continue
+            event_key_error = self.create_attr_key_error_from_bytearray("event", len(batch), b_array)
+            for event in batch:
+                if event.name in event_key_error:
+                    resp_key_values[event.name] = event_key_error[event.name]
+                    if event_key_error[event.name] == 0:
+                        event.add_subscriber(event_callback, lazy)
+        return resp_key_values
 
-    def subscribe_events(self, event_list, event_callback, event_duration):
+    def subscribe_events_single(self, event_list, event_callback, event_duration, lazy=False):
         generic_connector = self.get_connector("generic_connector")
         f = generic_connector.get_function('subscribe_event')
         resp_key_values = {}
+        request_messages = []
         for event in event_list:
             request_message = bytearray()
-            dt_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
-            dt_duration = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT32'))
+            dt_uid = self.platform.get_codec('UINT16')
+            dt_duration = self.platform.get_codec('UINT32')
             request_message.extend(RPCFuncHdr(generic_connector.uid, f.uid, f.num_of_args(), dt_uid.size + dt_duration.size).to_bytes())
-            request_message.extend(dt_uid.to_bytes(event.uid))
-            request_message.extend(dt_duration.to_bytes(event_duration))
-            response_message = self.com_wrapper.send(request_message)
+            request_message.extend(dt_uid.pack(event.uid))
+            request_message.extend(dt_duration.pack(event_duration))
+            request_messages.append(request_message)
+        for event, response_message in zip(event_list, self.send_requests(request_messages)):
             line_ptr = 0
-            ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+            ret_hdr = read_RPCRetHdr(response_message)
             line_ptr += len(ret_hdr)
             if ret_hdr.ret_code == 0:
-                # p_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(response_message[line_ptr:])
+                # p_uid = self.platform.get_codec('UINT16').unpack_from(response_message, line_ptr)[0]
                 # line_ptr += 2
-                resp_key_values[event.name] = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8')).read_bytes(response_message[line_ptr:])
+                resp_key_values[event.name] = self.platform.get_codec('INT8').unpack_from(response_message, line_ptr)[0]
                 line_ptr += 1
-                event.subscriber_callbacks.append(event_callback)
+                event.add_subscriber(event_callback, lazy)
                 # line_ptr += event.datatype.size
         return resp_key_values
 
@@ -326,20 +582,20 @@ class RPCNode(SensorNode):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_prepare_ota_update")
         request_message = bytearray()
-        dt_uint8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT8'))
-        dt_uint16 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
-        dt_int8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8'))
+        dt_uint8 = self.platform.get_codec('UINT8')
+        dt_uint16 = self.platform.get_codec('UINT16')
+        dt_int8 = self.platform.get_codec('INT8')
         arg_len = dt_uint8.size + len(nodes) * dt_uint16.size
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), arg_len).to_bytes())
-        request_message.extend(dt_uint8.to_bytes(len(nodes)))
+        request_message.extend(dt_uint8.pack(len(nodes)))
         for node in nodes:
-            request_message.extend(dt_uint16.to_bytes(node))
+            request_message.extend(dt_uint16.pack(node))
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            err = dt_int8.read_bytes(response_message[line_ptr:])
+            err = dt_int8.unpack_from(response_message, line_ptr)[0]
             return err
         return -1
 
@@ -347,27 +603,27 @@ class RPCNode(SensorNode):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_allocate_memory")
         request_message = bytearray()
-        dt_uint16 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
-        dt_uint32 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT32'))
+        dt_uint16 = self.platform.get_codec('UINT16')
+        dt_uint32 = self.platform.get_codec('UINT32')
         arg_len = dt_uint16.size + dt_uint16.size + dt_uint16.size
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), arg_len).to_bytes())
-        request_message.extend(dt_uint16.to_bytes(elf_file_size))
-        request_message.extend(dt_uint16.to_bytes(rom_size))
-        request_message.extend(dt_uint16.to_bytes(ram_size))
+        request_message.extend(dt_uint16.pack(elf_file_size))
+        request_message.extend(dt_uint16.pack(rom_size))
+        request_message.extend(dt_uint16.pack(ram_size))
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            rom_addr = dt_uint32.read_bytes(response_message[line_ptr:])
+            rom_addr = dt_uint32.unpack_from(response_message, line_ptr)[0]
             line_ptr += dt_uint32.size
-            ram_addr = dt_uint32.read_bytes(response_message[line_ptr:])
+            ram_addr = dt_uint32.unpack_from(response_message, line_ptr)[0]
             line_ptr += dt_uint32.size
-            ret_rom_size = dt_uint16.read_bytes(response_message[line_ptr:])
+            ret_rom_size = dt_uint16.unpack_from(response_message, line_ptr)[0]
             line_ptr += dt_uint16.size
-            ret_ram_size = dt_uint16.read_bytes(response_message[line_ptr:])
+            ret_ram_size = dt_uint16.unpack_from(response_message, line_ptr)[0]
             line_ptr += dt_uint16.size
-            ret_file_size = dt_uint16.read_bytes(response_message[line_ptr:])
+            ret_file_size = dt_uint16.unpack_from(response_message, line_ptr)[0]
             return [rom_addr, ram_addr, ret_rom_size, ret_ram_size, ret_file_size]
         return -1
 
@@ -375,37 +631,59 @@ class RPCNode(SensorNode):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_store_file")
         request_message = bytearray()
-        dt_uint16 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16'))
-        dt_uint8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT8'))
-        dt_int8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8'))
+        dt_uint16 = self.platform.get_codec('UINT16')
+        dt_uint8 = self.platform.get_codec('UINT8')
+        dt_int8 = self.platform.get_codec('INT8')
         arg_len = dt_uint8.size + dt_uint8.size + dt_uint16.size + dt_uint8.size * block_size
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), arg_len).to_bytes())
-        request_message.extend(dt_uint8.to_bytes(is_last))
-        request_message.extend(dt_uint8.to_bytes(block_size))
-        request_message.extend(dt_uint16.to_bytes(block_offset))
+        request_message.extend(dt_uint8.pack(is_last))
+        request_message.extend(dt_uint8.pack(block_size))
+        request_message.extend(dt_uint16.pack(block_offset))
         for b in block_data:
-            request_message.extend(dt_uint8.to_bytes(b))
+            request_message.extend(dt_uint8.pack(b))
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            err = dt_int8.read_bytes(response_message[line_ptr:])
+            err = dt_int8.unpack_from(response_message, line_ptr)[0]
             return err
         return -1
 
+    def supports_blockwise_upload(self):
+        return hasattr(self.com_wrapper, "send_blockwise")
+
+    def upload_file(self, file_data, block_size=128):
+        """
+        Store a complete file (e.g. an ELF software module) on the node in a single call.
+        Uses a CoAP Block1 transfer when the com_wrapper supports it, otherwise one
+        store_file RPC per block of block_size bytes.
+        Returns 0 on success.
+        """
+        if self.supports_blockwise_upload():
+            if self.com_wrapper.send_blockwise("wishful_file", file_data):
+                return 0
+            return -1
+        for block_offset in range(0, len(file_data), block_size):
+            block_data = file_data[block_offset:block_offset + block_size]
+            is_last = int(block_offset + block_size >= len(file_data))
+            err = self.store_file(is_last, len(block_data), block_offset, block_data)
+            if err != 0:
+                return err
+        return 0
+
     def disseminate_file(self):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_disseminate_file")
         request_message = bytearray()
-        dt_int8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8'))
+        dt_int8 = self.platform.get_codec('INT8')
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), 0).to_bytes())
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            err = dt_int8.read_bytes(response_message[line_ptr:])
+            err = dt_int8.unpack_from(response_message, line_ptr)[0]
             return err
         return -1
 
@@ -413,14 +691,14 @@ class RPCNode(SensorNode):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_install_module")
         request_message = bytearray()
-        dt_int8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8'))
+        dt_int8 = self.platform.get_codec('INT8')
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), 0).to_bytes())
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            err = dt_int8.read_bytes(response_message[line_ptr:])
+            err = dt_int8.unpack_from(response_message, line_ptr)[0]
             return err
         return -1
 
@@ -428,24 +706,32 @@ class RPCNode(SensorNode):
         gitar_connector = self.get_connector("generic_connector")
         f = gitar_connector.get_function("gitar_mgmt_activate_module")
         request_message = bytearray()
-        dt_int8 = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('INT8'))
+        dt_int8 = self.platform.get_codec('INT8')
         request_message.extend(RPCFuncHdr(gitar_connector.uid, f.uid, f.num_of_args(), 0).to_bytes())
         line_ptr = 0
         response_message = self.com_wrapper.send(request_message)
-        ret_hdr = read_RPCRetHdr(response_message[line_ptr:])
+        ret_hdr = read_RPCRetHdr(response_message)
         line_ptr += len(ret_hdr)
         if ret_hdr.ret_code == 0:
-            err = dt_int8.read_bytes(response_message[line_ptr:])
+            err = dt_int8.unpack_from(response_message, line_ptr)[0]
             return err
         return -1
 
     def dispatch_event(self, event_msg):
-        event_uid = ControlDataType(self.platform.endianness_fmt, self.platform.get_data_type_format_by_name('UINT16')).read_bytes(event_msg[0:2])
+        event_uid = self.platform.get_codec('UINT16').unpack_from(event_msg[0:2])[0]
         event = self.get_attr_by_key("event", event_uid)
-        event_value = event.datatype.read_bytes(event_msg[3:])
-        self.log.debug("RPC node {}: dispatching event {}: {} ".format(self.interface, event_uid, event_value))
-        for subscriber_cb in event.subscriber_callbacks:
-            subscriber_cb(self.interface, event.name, event_value)
+        if event is None or not event.has_subscribers():
+            # nobody listens, do not spend time decoding the payload
+            self.log.debug("RPC node %s: dropping event %d without subscribers", self.interface, event_uid)
+            return
+        payload = EventPayloadView(event.datatype, memoryview(event_msg), 3)
+        for subscriber_cb in event.lazy_subscriber_callbacks:
+            subscriber_cb(self.interface, event.name, payload)
+        if event.subscriber_callbacks:
+            event_value = payload.value
+            self.log.debug("RPC node %s: dispatching event %d: %s", self.interface, event_uid, event_value)
+            for subscriber_cb in event.subscriber_callbacks:
+                subscriber_cb(self.interface, event.name, event_value)
 
     def reset(self):
         pass
@@ -472,7 +758,7 @@ class RPCNode(SensorNode):
                 # print(ret_hdr)
                 if ret_hdr.ret_code == 0:
                     if f.get_ret_datatype() is not None:
-                        return f.get_ret_datatype().read_bytes(response_message[len(ret_hdr):])
+                        return f.get_ret_datatype().unpack_from(memoryview(response_message), len(ret_hdr))[0]
             else:
                 self.log.info("length argument list {} {} not correct {}".format(fargs, len(fargs), len(f.get_args_datatypes())))
                 return None
@@ -486,4 +772,4 @@ class RPCNode(SensorNode):
         ret_hdr = read_RPCRetHdr(response_message)
         if ret_hdr.ret_code == 0:
             if function_def['ret'] is not None:
-                return function_def['ret'].read_bytes(response_message[len(ret_hdr):])
+                return function_def['ret'].unpack_from(memoryview(response_message), len(ret_hdr))[0]